@@ -0,0 +1,281 @@
+""" Host benchmarks of the drivers against the instrumented mocks.
+
+    python bench/bench.py [-o results.json] [--repeat 5]
+    python bench/bench.py --compare baseline.json [--threshold 10] [--wall-threshold 50]
+
+For every hot operation: minimum wall time, pin operations (Pin init/value calls and
+mem32 writes), SPI transfers and bytes, and the peak of memory allocated while it runs.
+The counting mocks do not allocate, mem32 writes are counted but not recorded.
+The compare mode runs the benchmarks, prints the differences with the baseline file and
+exits with 1 when a counter got worse by more than the threshold (percent), the wall time
+by more than the wall threshold, or when a benchmark of the baseline fails or is no
+longer there. """
+
+import host
+import sys
+import os
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import tracemalloc
+
+from host import counters, CountingPin, CountingSPI
+import mocks
+
+METRICS = ('wall_us', 'pin_ops', 'spi_transactions', 'spi_bytes', 'alloc_bytes')
+
+WIDTH = 128
+HEIGHT = 64
+
+def _frame():
+    return bytearray((i * 7) & 0xFF for i in range(WIDTH * HEIGHT // 8))
+
+def _pins(count, first):
+    return [CountingPin(first + i, mocks.OUT) for i in range(count)]
+
+def bench_ks0108():
+    import ks0108
+    lcd = ks0108.Ks0108(WIDTH, HEIGHT, CountingPin(0), _pins(2, 1), CountingPin(3), CountingPin(4), None, _pins(8, 5))
+    lcd.init()
+    frame = _frame()
+    def op():
+        lcd.invalidate()
+        lcd.print_buffer(frame)
+    return op
+
+def bench_ks0108_sio():
+    import ks0108
+    lcd = ks0108.Ks0108(WIDTH, HEIGHT, CountingPin(0), _pins(2, 1), CountingPin(3), CountingPin(4), None, _pins(8, 5),
+                        e_gpio=0, data_gpios=list(range(5, 13)))
+    lcd.init()
+    frame = _frame()
+    def op():
+        lcd.invalidate()
+        lcd.print_buffer(frame)
+    return op
+
+def _spi_ks0108(e):
+    import mcp23Sxx
+    import spi_ks0108
+    ioext = mcp23Sxx.MCP23S17(CountingSPI(), CountingPin(20))
+    ioext.begin()
+    data = [spi_ks0108.B_0 << i for i in range(8)]
+    lcd = spi_ks0108.SpiKs0108(WIDTH, HEIGHT, ioext, e, [spi_ks0108.A_0, spi_ks0108.A_1], spi_ks0108.A_2, spi_ks0108.A_3, None, data)
+    lcd.init()
+    frame = _frame()
+    def op():
+        lcd.invalidate()
+        lcd.print_buffer(frame)
+    return op
+
+def bench_spi_ks0108():
+    return _spi_ks0108(CountingPin(0))
+
+def bench_spi_ks0108_burst():
+    import spi_ks0108
+    return _spi_ks0108(spi_ks0108.A_7)
+
+def bench_async_ks0108():
+    import async_ks0108
+    lcd = async_ks0108.AsyncKs0108(WIDTH, HEIGHT, CountingPin(0), _pins(2, 1), CountingPin(3), CountingPin(4), None, _pins(8, 5))
+    asyncio.run(lcd.init())
+    frame = _frame()
+    def op():
+        lcd.invalidate()
+        asyncio.run(lcd.print_buffer(frame))
+    return op
+
+def bench_bmp():
+    import bmp_display_driver
+    bmp = bmp_display_driver.Bmp(os.path.join(mocks.Pin.path, 'frame.bmp'), WIDTH, HEIGHT)
+    asyncio.run(bmp.init())
+    frame = _frame()
+    def op():
+        asyncio.run(bmp.print_buffer(frame))
+    return op
+
+def bench_recorder():
+    import recorder_display_driver
+    recorder = recorder_display_driver.Recorder(os.path.join(mocks.Pin.path, 'frames.rec'), WIDTH, HEIGHT, capacity=4096)
+    asyncio.run(recorder.init())
+    frame = _frame()
+    async def frames():
+        # Changed frames and repeats
+        for i in range(100):
+            frame[i] ^= 0x01
+            await recorder.print_buffer(frame)
+            await recorder.print_buffer(frame)
+    def op():
+        asyncio.run(frames())
+    return op
+
+def bench_mcp23s17_read_gpio():
+    import mcp23Sxx
+    ioext = mcp23Sxx.MCP23S17(CountingSPI(0x55), CountingPin(20))
+    ioext.begin()
+    def op():
+        for i in range(1000):
+            ioext.read_gpio()
+    return op
+
+def bench_mcp23s17_irq_dispatch():
+    import mcp23Sxx
+    # Every pin flagged in INTF
+    ioext = mcp23Sxx.MCP23S17(CountingSPI(0xFF), CountingPin(20), pin_int=CountingPin(21))
+    ioext.begin()
+    calls = [0]
+    def handler(level):
+        calls[0] += 1
+    for pin in range(16):
+        ioext.registerInterruptHandler(pin, handler)
+    def op():
+        for i in range(100):
+            ioext._irqHandler(None)
+    return op
+
+def bench_mcp3xxx_10k():
+    import mcp3xxx
+    adc = mcp3xxx.Mcp3xxx(CountingSPI(0x12), CountingPin(22))
+    def op():
+        for i in range(10000):
+            adc.read_u16()
+    return op
+
+def bench_mcp48x2_10k():
+    import mcp48x2
+    dac = mcp48x2.Mcp48x2(CountingSPI(), CountingPin(23))
+    def op():
+        for i in range(10000):
+            dac.write_u16(i & 0xFFF)
+    return op
+
+BENCHMARKS = {
+    'ks0108.print_buffer': bench_ks0108,
+    'ks0108_sio.print_buffer': bench_ks0108_sio,
+    'spi_ks0108.print_buffer': bench_spi_ks0108,
+    'spi_ks0108_burst.print_buffer': bench_spi_ks0108_burst,
+    'async_ks0108.print_buffer': bench_async_ks0108,
+    'bmp.print_buffer': bench_bmp,
+    'recorder.print_buffer_x200': bench_recorder,
+    'mcp23s17.read_gpio_x1000': bench_mcp23s17_read_gpio,
+    'mcp23s17.irq_dispatch_x100': bench_mcp23s17_irq_dispatch,
+    'mcp3xxx.read_u16_x10000': bench_mcp3xxx_10k,
+    'mcp48x2.write_u16_x10000': bench_mcp48x2_10k,
+}
+
+def measure(setup, repeat):
+    op = setup()
+    op() # warm up
+
+    # Counters and allocations from one run, wall time as the minimum of the others,
+    # the least disturbed by the rest of the machine
+    counters.reset()
+    mocks.mem32.count = 0
+    op()
+    result = {
+        'pin_ops': counters.pin_ops + mocks.mem32.count,
+        'spi_transactions': counters.spi_transactions,
+        'spi_bytes': counters.spi_bytes,
+    }
+
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    base = tracemalloc.get_traced_memory()[0]
+    op()
+    result['alloc_bytes'] = tracemalloc.get_traced_memory()[1] - base
+    tracemalloc.stop()
+
+    wall = None
+    for i in range(repeat):
+        start = time.perf_counter_ns()
+        op()
+        elapsed = time.perf_counter_ns() - start
+        if wall == None or elapsed < wall:
+            wall = elapsed
+    result['wall_us'] = wall // 1000
+    return result
+
+def run(names, repeat):
+    results = {}
+    mocks.mem32.record = False
+    for name in names:
+        with tempfile.TemporaryDirectory() as directory:
+            # Scratch directory for the Bmp output, and the pin files with mocks.FileBackend
+            mocks.Pin.path = directory
+            try:
+                results[name] = measure(BENCHMARKS[name], repeat)
+            except Exception as e:
+                results[name] = {'error': '{}: {}'.format(type(e).__name__, e)}
+    return results
+
+def compare(baseline, results, threshold, wall_threshold):
+    """ Prints the metrics of results against baseline, returns the regressions. A benchmark
+    failing now but not in the baseline, or missing from results, is one. The wall time,
+    which varies between runs unlike the counters, has its own threshold """
+    regressions = []
+    for name, base in baseline.items():
+        if name not in results:
+            print('{:32} missing'.format(name))
+            regressions.append((name, 'missing', base.get('error', 'ok'), 'missing'))
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base == None:
+            print('{:32} new'.format(name))
+            continue
+        if 'error' in result:
+            print('{:32} {}'.format(name, result['error']))
+            if 'error' not in base:
+                regressions.append((name, 'error', 'ok', result['error']))
+            continue
+        if 'error' in base:
+            print('{:32} fixed, was {}'.format(name, base['error']))
+            continue
+        line = []
+        for metric in METRICS:
+            old = base.get(metric, 0)
+            new = result.get(metric, 0)
+            change = (new - old) * 100 / old if old else (0 if new == old else 100)
+            line.append('{} {} -> {} ({:+.1f}%)'.format(metric, old, new, change))
+            if change > (wall_threshold if metric == 'wall_us' else threshold):
+                regressions.append((name, metric, old, new))
+        print('{:32} {}'.format(name, ', '.join(line)))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks the drivers against the mocks')
+    parser.add_argument('-o', '--output', help='JSON file to save the results to')
+    parser.add_argument('--compare', help='baseline JSON file to compare the results with')
+    parser.add_argument('--threshold', type=float, default=10, help='regression threshold in percent (default 10)')
+    parser.add_argument('--wall-threshold', type=float, default=50, help='wall time regression threshold in percent (default 50)')
+    parser.add_argument('--repeat', type=int, default=10, help='timed runs per benchmark (default 10)')
+    parser.add_argument('names', nargs='*', help='benchmarks to run (default all)')
+    args = parser.parse_args()
+
+    names = args.names or list(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            parser.error('unknown benchmark {}, one of {}'.format(name, ', '.join(BENCHMARKS)))
+
+    results = run(names, args.repeat)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if args.names:
+            baseline = {name: baseline[name] for name in names if name in baseline}
+        regressions = compare(baseline, results, args.threshold, args.wall_threshold)
+        for name, metric, old, new in regressions:
+            print('REGRESSION {} {}: {} -> {}'.format(name, metric, old, new))
+        return 1 if regressions else 0
+
+    for name, result in results.items():
+        print('{:32} {}'.format(name, json.dumps(result, sort_keys=True)))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,92 @@
+""" Checks that the MCP23S17 register and GPIO accesses do not allocate, against the mocks.
+
+    python bench/check_alloc.py
+
+Each operation runs once to warm up, then traced: at every line executed, the memory blocks
+still alive that were allocated by a line of drivers/ are reported, and the exit code is 1 when
+there is any. What only CPython allocates is not counted: the ints above 256, which MicroPython
+keeps in the object word up to 2**30, the range iterators of the for loops, which MicroPython
+compiles to a counter, and the frames created for the tracing. """
+
+import host
+import sys
+import os
+import re
+import linecache
+import tracemalloc
+
+from host import CountingPin, CountingSPI
+
+DRIVERS = os.path.join(host.ROOT, 'drivers')
+FOR_RANGE = re.compile(r'\s*for .* in range\(')
+
+def _int_size():
+    # Size of the block of a one digit int, as seen by tracemalloc
+    tracemalloc.start()
+    value = (1 << 29) + len(sys.argv)
+    snapshot = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    return [stat.size for stat in snapshot.traces if stat.traceback[0].filename == __file__][0]
+
+INT_SIZE = _int_size()
+
+def _operations():
+    import mcp23Sxx
+    ioext = mcp23Sxx.MCP23S17(CountingSPI(), CountingPin(20))
+    ioext.begin()
+    # Alternate the values, an unchanged latch is not written
+    state = [0]
+    def write_gpio():
+        state[0] ^= 1
+        ioext.write_gpio(0x0101 if state[0] else 0x0202)
+    def write_register():
+        state[0] ^= 1
+        ioext._writeRegister(mcp23Sxx.MCP23S17_OLATA, state[0])
+    return {
+        'read_gpio': ioext.read_gpio,
+        'write_gpio': write_gpio,
+        '_writeRegister': write_register,
+        '_readRegister': lambda: ioext._readRegister(mcp23Sxx.MCP23S17_GPIOA),
+    }
+
+def _micropython_free(origin, size, functions):
+    if size == INT_SIZE or (origin.filename, origin.lineno) in functions:
+        return True
+    return FOR_RANGE.match(linecache.getline(origin.filename, origin.lineno)) != None
+
+def allocations(op):
+    """ Returns the (file, line, size) of the blocks allocated by drivers/ seen alive during op """
+    found = set()
+    functions = set()
+    def trace(frame, event, arg):
+        code = frame.f_code
+        functions.add((code.co_filename, code.co_firstlineno))
+        if event in ('line', 'return'):
+            for stat in tracemalloc.take_snapshot().traces:
+                origin = stat.traceback[0]
+                if origin.filename.startswith(DRIVERS) and not _micropython_free(origin, stat.size, functions):
+                    found.add((os.path.relpath(origin.filename, host.ROOT), origin.lineno, stat.size))
+        return trace
+    op() # warm up
+    tracemalloc.start()
+    sys.settrace(trace)
+    try:
+        op()
+        op()
+    finally:
+        sys.settrace(None)
+        tracemalloc.stop()
+    return sorted(found)
+
+def main():
+    failed = False
+    for name, op in _operations().items():
+        found = allocations(op)
+        print('{:16} {}'.format(name, 'allocates' if found else 'ok'))
+        for filename, lineno, size in found:
+            print('    {}:{} {} bytes'.format(filename, lineno, size))
+        failed = failed or bool(found)
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,205 @@
+""" Checks the KS0108 drivers against the controller emulator of the mocks.
+
+    python bench/check_ks0108.py [names]
+
+Every driver is decoded from its bus traffic: the Pin transitions, the MCP23S17 SPI
+transfers or the PIO FIFO words. For each one, the display RAM must match after full and
+incremental frames and after random write_at() calls, the frame copy must be in step with
+it (the next print_buffer sends nothing) and scroll() must rotate the visible pages.
+write_at() on a page out of the display must raise ValueError without any bus cycle, and
+init() must make the next print_buffer send the whole frame.
+The exit code is 1 when a check fails. """
+
+import host
+import sys
+import random
+import asyncio
+
+import mocks
+import mocks.rp2
+from mocks.ks0108_emulator import Ks0108Emulator, PinDecoder, ExpanderDecoder, Mcp23s17Device, PioDecoder
+
+WIDTH = 128
+HEIGHT = 64
+PAGES = HEIGHT // 8
+
+def _sync(result):
+    return result
+
+def _async(result):
+    return asyncio.run(result)
+
+def _pins_driver(cls):
+    # Pins 0 e, 1-2 cs, 3 rs, 4 rw, 5-12 data. The decoder must see every transition
+    # from the creation of the pins
+    mocks.Pin.tracer = mocks.Tracer()
+    emulator = Ks0108Emulator(WIDTH, HEIGHT)
+    decoder = PinDecoder(emulator, 0, [1, 2], 3, 4, list(range(5, 13)))
+    lcd = cls(WIDTH, HEIGHT, mocks.Pin(0), [mocks.Pin(1), mocks.Pin(2)], mocks.Pin(3), mocks.Pin(4), None,
+              [mocks.Pin(i) for i in range(5, 13)])
+    def feed():
+        decoder.feed(mocks.Pin.tracer.transitions())
+        mocks.Pin.tracer.clear()
+    return lcd, emulator, feed
+
+def setup_ks0108():
+    import ks0108
+    return _pins_driver(ks0108.Ks0108) + (_sync,)
+
+def setup_async_ks0108():
+    import async_ks0108
+    return _pins_driver(async_ks0108.AsyncKs0108) + (_async,)
+
+def _spi_ks0108(burst):
+    import mcp23Sxx
+    import spi_ks0108
+    data = [spi_ks0108.B_0 << i for i in range(8)]
+    cs = [spi_ks0108.A_0, spi_ks0108.A_1]
+    emulator = Ks0108Emulator(WIDTH, HEIGHT)
+    decoder = ExpanderDecoder(emulator, spi_ks0108.A_7 if burst else None, cs, spi_ks0108.A_2, spi_ks0108.A_3, data)
+    device = Mcp23s17Device(decoder.output)
+    ioext = mcp23Sxx.MCP23S17(device.spi, device.cs)
+    ioext.begin()
+    ioext.setup_pins({i: (mocks.Pin.OUT, 0) for i in range(16)})
+    e = spi_ks0108.A_7 if burst else decoder.e_pin
+    lcd = spi_ks0108.SpiKs0108(WIDTH, HEIGHT, ioext, e, cs, spi_ks0108.A_2, spi_ks0108.A_3, None, data)
+    return lcd, emulator, lambda: None, _sync
+
+def setup_spi_ks0108():
+    return _spi_ks0108(False)
+
+def setup_spi_ks0108_burst():
+    return _spi_ks0108(True)
+
+def _pio_ks0108(dma):
+    import pio_ks0108
+    mocks.rp2.fifo_log.clear()
+    emulator = Ks0108Emulator(WIDTH, HEIGHT)
+    decoder = PioDecoder(emulator, dma)
+    lcd = pio_ks0108.PioKs0108(WIDTH, HEIGHT, mocks.Pin(0), mocks.Pin(1), mocks.Pin(2), None, dma=dma)
+    def feed():
+        decoder.feed(mocks.rp2.fifo_log)
+        mocks.rp2.fifo_log.clear()
+    return lcd, emulator, feed, _sync
+
+def setup_pio_ks0108():
+    return _pio_ks0108(False)
+
+def setup_pio_ks0108_dma():
+    return _pio_ks0108(True)
+
+DRIVERS = {
+    'ks0108': setup_ks0108,
+    'async_ks0108': setup_async_ks0108,
+    'spi_ks0108': setup_spi_ks0108,
+    'spi_ks0108_burst': setup_spi_ks0108_burst,
+    'pio_ks0108': setup_pio_ks0108,
+    'pio_ks0108_dma': setup_pio_ks0108_dma,
+}
+
+def _scrolled(buffer, pages):
+    # The frame seen with the start line moved down by whole pages
+    row = WIDTH
+    return b''.join(buffer[((page + pages) % PAGES) * row:((page + pages) % PAGES + 1) * row] for page in range(PAGES))
+
+def _concurrent_write_at(lcd, emulator, feed, frame):
+    # A write_at() from another task onto a page the flush has already sent, while the
+    # flush yields: the frame copy must stay in step with the panel
+    async def flush():
+        changed = bytearray(frame)
+        changed[len(frame) - 1] ^= 0xff
+        async def other():
+            await asyncio.sleep(0)
+            await lcd.write_at(0, 0, b'\xaa\xbb')
+        task = asyncio.create_task(other())
+        await lcd.print_buffer(changed)
+        await task
+        # The second flush must put back the bytes the write_at() changed
+        await lcd.print_buffer(changed)
+        return changed
+    changed = asyncio.run(flush())
+    feed()
+    return emulator.framebuffer() == changed
+
+def check(name, rng):
+    """ Returns the failed checks of a driver """
+    lcd, emulator, feed, run = DRIVERS[name]()
+    failures = []
+    run(lcd.init())
+    feed()
+
+    frame = bytearray(rng.randrange(256) for i in range(WIDTH * PAGES))
+    for step in range(3):
+        run(lcd.print_buffer(frame))
+        feed()
+        if emulator.framebuffer() != frame or emulator.screen() != frame:
+            failures.append('print_buffer frame {}'.format(step))
+        frame = bytearray(frame)
+        for i in range(rng.randrange(1, 8)):
+            frame[rng.randrange(len(frame))] ^= 1 << rng.randrange(8)
+
+    run(lcd.print_buffer(frame))
+    feed()
+    for i in range(50):
+        page = rng.randrange(PAGES)
+        column = rng.randrange(WIDTH)
+        data = bytes(rng.randrange(256) for j in range(rng.randrange(1, WIDTH - column + 1)))
+        run(lcd.write_at(page, column, data))
+        feed()
+        frame[page * WIDTH + column:page * WIDTH + column + len(data)] = data
+    if emulator.framebuffer() != frame:
+        failures.append('write_at')
+    sent = run(lcd.print_buffer(frame))
+    feed()
+    # DMA mode streams whole frames
+    if sent and name != 'pio_ks0108_dma':
+        failures.append('frame copy after write_at: {} bytes resent'.format(sent))
+
+    run(lcd.scroll(8))
+    feed()
+    if emulator.screen() != _scrolled(frame, 1):
+        failures.append('scroll(8)')
+    run(lcd.scroll(-8))
+    feed()
+    if emulator.screen() != frame:
+        failures.append('scroll(-8)')
+
+    emulator.reset_counters()
+    try:
+        run(lcd.write_at(PAGES, 0, b'\xff'))
+        failures.append('write_at page {} accepted'.format(PAGES))
+    except ValueError:
+        pass
+    feed()
+    if emulator.commands or emulator.data_writes:
+        failures.append('bus cycles for a page out of the display')
+
+    if run is _async and not _concurrent_write_at(lcd, emulator, feed, frame):
+        failures.append('write_at during a flush')
+
+    # The display RAM is unknown after init(), the whole frame is sent again
+    run(lcd.init())
+    feed()
+    sent = run(lcd.print_buffer(frame))
+    feed()
+    if sent < len(frame) or emulator.framebuffer() != frame:
+        failures.append('frame after init(): {} bytes sent'.format(sent))
+
+    mocks.Pin.tracer = None
+    return failures
+
+def main():
+    names = sys.argv[1:] or list(DRIVERS)
+    for name in names:
+        if name not in DRIVERS:
+            print('unknown driver {}, one of {}'.format(name, ', '.join(DRIVERS)))
+            return 2
+    failed = False
+    for name in names:
+        failures = check(name, random.Random(1))
+        print('{:20} {}'.format(name, ', '.join(failures) if failures else 'ok'))
+        failed = failed or bool(failures)
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,95 @@
+""" Runs the drivers under CPython: the mocks stand in for machine and rp2, and the
+MicroPython only parts of time, asyncio and micropython are provided. Import this
+module before any driver. """
+
+import sys
+import os
+import time
+import types
+import asyncio
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in ('drivers', 'drivers/ks0108', 'drivers/bmp', 'drivers/recorder'):
+    sys.path.insert(0, os.path.join(ROOT, path))
+sys.path.insert(0, ROOT)
+
+import mocks
+import mocks.rp2
+sys.modules['machine'] = mocks
+sys.modules['rp2'] = mocks.rp2
+
+if not hasattr(time, 'ticks_us'):
+    time.sleep_us = lambda us: None
+    time.sleep_ms = lambda ms: None
+    time.ticks_us = lambda: time.perf_counter_ns() // 1000
+    time.ticks_ms = lambda: time.perf_counter_ns() // 1000000
+    time.ticks_diff = lambda a, b: a - b
+    time.ticks_add = lambda a, b: a + b
+
+if 'micropython' not in sys.modules:
+    micropython = types.ModuleType('micropython')
+    # No interrupt context here: scheduled callbacks run at once
+    micropython.schedule = lambda callback, arg: callback(arg)
+    micropython.const = lambda value: value
+    sys.modules['micropython'] = micropython
+
+if not hasattr(asyncio, 'ThreadSafeFlag'):
+    class ThreadSafeFlag(asyncio.Event):
+        async def wait(self):
+            await super().wait()
+            self.clear()
+    asyncio.ThreadSafeFlag = ThreadSafeFlag
+    asyncio.sleep_ms = lambda ms: asyncio.sleep(ms / 1000)
+    asyncio.wait_for_ms = lambda awaitable, ms: asyncio.wait_for(awaitable, ms / 1000)
+
+class Counters():
+    """ Bus activity seen by the instrumented mocks """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.pin_ops = 0
+        self.spi_transactions = 0
+        self.spi_bytes = 0
+
+counters = Counters()
+
+class CountingPin(mocks.Pin):
+    """ mocks.Pin counting init() and value() calls """
+
+    def init(self, *args, **kwargs):
+        counters.pin_ops += 1
+        super().init(*args, **kwargs)
+
+    def value(self, v=None):
+        counters.pin_ops += 1
+        return super().value(v)
+
+def _nbytes(data):
+    # Bytes, not items: data may be an array('H'). Without a memoryview, which would
+    # be counted in the allocations
+    if isinstance(data, memoryview):
+        return data.nbytes
+    return len(data) * getattr(data, 'itemsize', 1)
+
+class CountingSPI(mocks.SPI):
+    """ mocks.SPI counting transfers and bytes. Reads return response in every byte """
+
+    def __init__(self, response=0x00):
+        self.response = response
+
+    def write(self, data):
+        counters.spi_transactions += 1
+        counters.spi_bytes += _nbytes(data)
+
+    def read(self, count):
+        counters.spi_transactions += 1
+        counters.spi_bytes += count
+        return bytes([self.response]) * count
+
+    def write_readinto(self, txdata, rxdata):
+        counters.spi_transactions += 1
+        counters.spi_bytes += _nbytes(txdata)
+        for i in range(len(rxdata)):
+            rxdata[i] = self.response
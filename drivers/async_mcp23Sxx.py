@@ -0,0 +1,211 @@
+from machine import Pin
+import asyncio
+import time
+import mcp23Sxx
+
+class _EventStream():
+    """ Async iterator of (pin, level, ticks_ms) interrupt events """
+
+    def __init__(self, owner, mask, debounce_ms, size):
+        self._owner = owner
+        self._mask = mask
+        self._debounce_ms = debounce_ms
+        self._last = [0] * 16
+        self._seen = 0
+        # Levels last emitted, and the edges dropped in a debounce window: pins, levels, ticks
+        self._emitted = 0
+        self._held = 0
+        self._held_levels = 0
+        self._held_ticks = [0] * 16
+        self._pins = bytearray(size)
+        self._levels = bytearray(size)
+        self._ticks = [0] * size
+        self._head = 0
+        self._count = 0
+        self._event = asyncio.Event()
+        self._closed = False
+        self.overruns = 0
+
+    def _push(self, pin, level, now):
+        bit = 1 << pin
+        if not (self._mask & bit):
+            return
+        if self._held:
+            self._release(now)
+        # Leading edge debounce: edges within the window after an accepted one are held, the
+        # level at the end of the window is emitted if it is not the last one emitted
+        if self._debounce_ms and (self._seen & bit) and time.ticks_diff(now, self._last[pin]) < self._debounce_ms:
+            self._held |= bit
+            if level:
+                self._held_levels |= bit
+            else:
+                self._held_levels &= ~bit
+            self._held_ticks[pin] = now
+            # Wakes __anext__ up to wait for the end of the window
+            self._event.set()
+            return
+        self._accept(pin, level, now)
+
+    def _accept(self, pin, level, now):
+        bit = 1 << pin
+        self._seen |= bit
+        self._last[pin] = now
+        if level:
+            self._emitted |= bit
+        else:
+            self._emitted &= ~bit
+        size = len(self._pins)
+        if self._count == size:
+            self.overruns += 1
+            return
+        index = (self._head + self._count) % size
+        self._pins[index] = pin
+        self._levels[index] = level
+        self._ticks[index] = now
+        self._count += 1
+        self._event.set()
+
+    def _release(self, now):
+        """ Ends the debounce windows elapsed at now: the held level is emitted when it differs
+        from the last one, e.g. the release of a tap shorter than the window. Returns the ms
+        until the next window ends, None when no edge is held """
+        wait = None
+        held = self._held
+        pin = 0
+        while held:
+            if held & 0x1:
+                remaining = self._debounce_ms - time.ticks_diff(now, self._last[pin])
+                if remaining <= 0:
+                    bit = 1 << pin
+                    self._held &= ~bit
+                    level = (self._held_levels >> pin) & 0x1
+                    if level != (self._emitted >> pin) & 0x1:
+                        self._accept(pin, level, self._held_ticks[pin])
+                elif wait == None or remaining < wait:
+                    wait = remaining
+            held >>= 1
+            pin += 1
+        return wait
+
+    def close(self):
+        self._closed = True
+        self._owner._streams.remove(self)
+        self._event.set()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while not self._count:
+            if self._closed:
+                raise StopAsyncIteration
+            self._event.clear()
+            wait = self._release(time.ticks_ms()) if self._held else None
+            if self._count:
+                break
+            if wait == None:
+                await self._event.wait()
+            else:
+                try:
+                    await asyncio.wait_for_ms(self._event.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+        index = self._head
+        self._head = (index + 1) % len(self._pins)
+        self._count -= 1
+        return (self._pins[index], self._levels[index], self._ticks[index])
+
+class AsyncMCP23S17():
+    """ asyncio front end of MCP23S17: register access is serialized behind a lock
+    and interrupts are delivered as event streams """
+
+    def __init__(self, spi, pin_cs, mode=mcp23Sxx.IOCON_HAEN, pin_int=None, device_id=0x00):
+        """ spi : initialized SPI bus (mode 0).
+        pin_cs : The Chip Select pin of the MCP.
+        mode : The global flags
+        pin_int : interrupt pin
+        device_id : The device ID of the component, i.e., the hardware address (default 0)
+        """
+        self._mcp = mcp23Sxx.MCP23S17(spi, pin_cs, mode, None, device_id)
+        # Shared with any other task using the same SPI bus
+        self.lock = asyncio.Lock()
+        self._flag = asyncio.ThreadSafeFlag()
+        self._streams = []
+        self._task = None
+        self._pin_int = pin_int
+        if self._pin_int != None:
+            self._pin_int.irq(self._irqHandler, Pin.IRQ_FALLING, hard=True)
+
+    async def init(self):
+        if self._pin_int != None and self._task == None:
+            self._task = asyncio.create_task(self._reader())
+
+    def events(self, pins=None, debounce_ms=0, size=16):
+        """ Returns an async iterator of (pin, level, ticks_ms) for the given pins (default all).
+        Pins must be set up with IOC_ENABLED. """
+        mask = 0xFFFF
+        if pins != None:
+            mask = 0
+            for pin in pins:
+                self._mcp._validate_pin(pin)
+                mask |= 1 << pin
+        stream = _EventStream(self, mask, debounce_ms, size)
+        self._streams.append(stream)
+        return stream
+
+    def _irqHandler(self, pin):
+        self._flag.set()
+
+    async def _reader(self):
+        # The INT line may already be active, no edge would be seen for it
+        self._flag.set()
+        while True:
+            await self._flag.wait()
+            async with self.lock:
+                flags = self._mcp._readInterrupts()
+            captured = self._mcp._INTCAP
+            now = time.ticks_ms()
+            pin = 0
+            while flags:
+                if flags & 0x1:
+                    level = (captured >> pin) & 0x1
+                    for stream in self._streams:
+                        stream._push(pin, level, now)
+                flags >>= 1
+                pin += 1
+
+    async def setup(self, pin, mode, flags=mcp23Sxx.INPUT_POL_SAME|mcp23Sxx.IOC_DISABLED):
+        async with self.lock:
+            self._mcp.setup(pin, mode, flags)
+
+    async def setup_pins(self, pins):
+        async with self.lock:
+            self._mcp.setup_pins(pins)
+
+    async def pullup(self, pin, enabled):
+        async with self.lock:
+            self._mcp.pullup(pin, enabled)
+
+    async def input(self, pin):
+        async with self.lock:
+            return self._mcp.input(pin)
+
+    async def input_pins(self, pins, read=True):
+        async with self.lock:
+            return self._mcp.input_pins(pins, read)
+
+    async def output(self, pin, level):
+        async with self.lock:
+            self._mcp.output(pin, level)
+
+    async def output_pins(self, pins):
+        async with self.lock:
+            self._mcp.output_pins(pins)
+
+    async def read_gpio(self):
+        async with self.lock:
+            return self._mcp.read_gpio()
+
+    async def write_gpio(self, data):
+        async with self.lock:
+            self._mcp.write_gpio(data)
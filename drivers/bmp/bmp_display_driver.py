@@ -1,16 +1,24 @@
-from display_drivers import DisplayDriver
+from display_drivers import AsyncDisplayDriver
 import sys
 import os
 
-class Bmp(DisplayDriver):
+class Bmp(AsyncDisplayDriver):
+    # A single write of the whole file per frame
+    _transactions = 1
+
     def __init__(self, filename, width, height) -> None:
+        """ width : multiple of 8, height : multiple of 8 (whole pages) """
         self._filename = filename
         self._width = width
         self._height = height
 
+        # 1 bit per pixel, each row padded to 4 bytes
+        self._stride = ((width + 31) // 32) * 4
+        size = self._stride * height
+
         self._header = bytearray(b'\x42\x4d')
         # BMP header
-        self._header += ((width * height)+62).to_bytes(4, sys.byteorder)
+        self._header += (size + 62).to_bytes(4, sys.byteorder)
         self._header += b'\x00\x00' # reserved
         self._header += b'\x00\x00' # reserved
         self._header += (62).to_bytes(4, sys.byteorder) # offset
@@ -20,9 +28,9 @@ class Bmp(DisplayDriver):
         self._header += (width).to_bytes(4, sys.byteorder) # image width
         self._header += (height).to_bytes(4, sys.byteorder) # image height
         self._header += (1).to_bytes(2, sys.byteorder) # number of color plane
-        self._header += (8).to_bytes(2, sys.byteorder) # number of bits per pixel
+        self._header += (1).to_bytes(2, sys.byteorder) # number of bits per pixel
         self._header += b'\x00\x00\x00\x00' # compression (0 = no compression)
-        self._header += (width * height).to_bytes(4, sys.byteorder) # image size
+        self._header += (size).to_bytes(4, sys.byteorder) # image size
         self._header += (65536).to_bytes(4, sys.byteorder) # horizontal res
         self._header += (65536).to_bytes(4, sys.byteorder) # vertical res
         self._header += (2).to_bytes(4, sys.byteorder) # number of colors (0 = 2^32)
@@ -32,25 +40,59 @@ class Bmp(DisplayDriver):
         self._header += b'\x00\x00\x00\x00' # black
         self._header += b'\xff\xff\xff\x00' # white
 
+        # Whole file, the header is written once and the row padding stays 0
+        self._file = bytearray(len(self._header) + size)
+        self._file[:len(self._header)] = self._header
+
     async def init(self) -> None:
         pass
 
-    async def print_buffer(self, buffer: bytearray) -> None:
-        f = open('{}-tmp'.format(self._filename), 'w')
-        self._add_header(f)
-
-        for i in range(0, self._height):
-            # Buffer 0,0 is upper left corner while it is lower left in BMP
-            height = (self._height - i) - 1
-            row = height // 8
-            bit = height % 8
-            for j in range(0, self._width):
-                index = (row * self._width) + j
-                val = ((buffer[index] >> bit) & 0x01).to_bytes(1)
-                f.write(val)
+    async def _flush(self, buffer: bytearray) -> int:
+        self._write_file(buffer)
+        return len(self._file)
+
+    def _write_file(self, buffer: bytearray) -> None:
+        self._encode(buffer)
+        f = open('{}-tmp'.format(self._filename), 'wb')
+        f.write(self._file)
         f.close()
         os.rename('{}-tmp'.format(self._filename), '{}'.format(self._filename))
 
-    def _add_header(self, f) -> None:
-        f.write(self._header)
+    def _encode(self, buffer: bytearray) -> None:
+        # Each 8x8 block (8 columns of a page) is transposed with 32 bits word operations
+        # (Hacker's Delight transpose8). A column byte has the top row in bit 0, so its
+        # transposition gives the rows bottom-up with the leftmost pixel in the MSB, which
+        # is the BMP row order and bit order.
+        out = self._file
+        width = self._width
+        stride = self._stride
+        for page in range(self._height // 8):
+            src = page * width
+            # BMP rows start at the bottom: the block rows 7..0 of this page
+            dst = 62 + (self._height - 8 - page * 8) * stride
+            for column in range(0, width, 8):
+                i = src + column
+                x = (buffer[i] << 24) | (buffer[i + 1] << 16) | (buffer[i + 2] << 8) | buffer[i + 3]
+                y = (buffer[i + 4] << 24) | (buffer[i + 5] << 16) | (buffer[i + 6] << 8) | buffer[i + 7]
+
+                t = (x ^ (x >> 7)) & 0x00AA00AA
+                x = x ^ t ^ (t << 7)
+                t = (y ^ (y >> 7)) & 0x00AA00AA
+                y = y ^ t ^ (t << 7)
+                t = (x ^ (x >> 14)) & 0x0000CCCC
+                x = x ^ t ^ (t << 14)
+                t = (y ^ (y >> 14)) & 0x0000CCCC
+                y = y ^ t ^ (t << 14)
+                t = (x & 0xF0F0F0F0) | ((y >> 4) & 0x0F0F0F0F)
+                y = ((x << 4) & 0xF0F0F0F0) | (y & 0x0F0F0F0F)
+                x = t
 
+                j = dst + (column >> 3)
+                out[j] = x >> 24
+                out[j + stride] = (x >> 16) & 0xFF
+                out[j + 2 * stride] = (x >> 8) & 0xFF
+                out[j + 3 * stride] = x & 0xFF
+                out[j + 4 * stride] = y >> 24
+                out[j + 5 * stride] = (y >> 16) & 0xFF
+                out[j + 6 * stride] = (y >> 8) & 0xFF
+                out[j + 7 * stride] = y & 0xFF
@@ -0,0 +1,143 @@
+from array import array
+from histogram import log2_bucket
+import time
+
+class FlushStats():
+    """ Per flush counters and duration histogram of a display driver. Nothing is allocated
+    while recording. """
+
+    # Flush duration histogram, see log2_bucket()
+    BUCKETS = 20
+
+    def __init__(self):
+        self.histogram = array('I', [0] * FlushStats.BUCKETS)
+        self.reset()
+
+    def reset(self):
+        for i in range(FlushStats.BUCKETS):
+            self.histogram[i] = 0
+        self.flushes = 0
+        # Last flush
+        self.duration = 0
+        self.bytes = 0
+        self.commands = 0
+        self.transactions = 0
+        # Since the last reset
+        self.duration_min = 0
+        self.duration_max = 0
+        self.duration_total = 0
+        self.bytes_total = 0
+        self.commands_total = 0
+        self.transactions_total = 0
+
+    def _record(self, duration, sent, commands, transactions):
+        if not self.flushes or duration < self.duration_min:
+            self.duration_min = duration
+        if duration > self.duration_max:
+            self.duration_max = duration
+        self.flushes += 1
+        self.duration = duration
+        self.bytes = sent
+        self.commands = commands
+        self.transactions = transactions
+        self.duration_total += duration
+        self.bytes_total += sent
+        self.commands_total += commands
+        self.transactions_total += transactions
+        self.histogram[log2_bucket(duration, FlushStats.BUCKETS)] += 1
+
+    def duration_avg(self):
+        if not self.flushes:
+            return 0
+        return self.duration_total // self.flushes
+
+    def percentile(self, p):
+        """ Upper bound in us of the histogram bucket holding the p-th percentile (0-100)
+        of the flush durations, capped by the largest duration seen """
+        if not self.flushes:
+            return 0
+        rank = (self.flushes * p + 99) // 100
+        count = 0
+        for bucket in range(FlushStats.BUCKETS):
+            count += self.histogram[bucket]
+            if count >= rank and count:
+                return min((1 << bucket) - 1, self.duration_max)
+        return self.duration_max
+
+    def as_dict(self):
+        return {
+            'flushes': self.flushes,
+            'duration': self.duration,
+            'duration_min': self.duration_min,
+            'duration_avg': self.duration_avg(),
+            'duration_max': self.duration_max,
+            'duration_p50': self.percentile(50),
+            'duration_p99': self.percentile(99),
+            'bytes': self.bytes,
+            'bytes_total': self.bytes_total,
+            'commands': self.commands,
+            'commands_total': self.commands_total,
+            'transactions': self.transactions,
+            'transactions_total': self.transactions_total,
+        }
+
+class DisplayDriver():
+    """ Base class of the display drivers. A driver sends MONO_VLSB frames with
+    print_buffer(buffer), which calls the _flush(buffer) of the driver.
+
+    Flush instrumentation is off by default: stats is None and print_buffer does not read
+    the clock. enable_stats() attaches a FlushStats updated by every print_buffer. """
+
+    stats = None
+    # Bus commands and transactions of the last flush, left by _flush()
+    _commands = 0
+    _transactions = 0
+
+    def init(self):
+        raise NotImplementedError
+
+    def print_buffer(self, buffer):
+        """ Sends buffer to the display. Returns the number of bytes sent """
+        if self.stats == None:
+            return self._flush(buffer)
+        start = time.ticks_us()
+        sent = self._flush(buffer)
+        self.stats._record(time.ticks_diff(time.ticks_us(), start), sent, self._commands, self._transactions)
+        return sent
+
+    def _flush(self, buffer):
+        """ Sends buffer, returns the number of bytes sent """
+        raise NotImplementedError
+
+    def invalidate(self):
+        """ Forces the next print_buffer to send the whole frame """
+        pass
+
+    def enable_stats(self):
+        """ Starts recording flush statistics and returns the FlushStats """
+        if self.stats == None:
+            self.stats = FlushStats()
+        return self.stats
+
+    def disable_stats(self):
+        self.stats = None
+
+class AsyncDisplayDriver(DisplayDriver):
+    """ Base class of the async display drivers: init(), print_buffer() and _flush() are
+    coroutines. The duration recorded in stats includes the time spent in other tasks. """
+
+    async def init(self):
+        raise NotImplementedError
+
+    async def print_buffer(self, buffer):
+        """ Sends buffer to the display. Returns the number of bytes sent """
+        if self.stats == None:
+            return await self._flush(buffer)
+        start = time.ticks_us()
+        sent = await self._flush(buffer)
+        self.stats._record(time.ticks_diff(time.ticks_us(), start), sent, self._commands, self._transactions)
+        return sent
+
+    async def _flush(self, buffer):
+        """ Sends buffer, returns the number of bytes sent """
+        raise NotImplementedError
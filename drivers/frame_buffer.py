@@ -0,0 +1,81 @@
+import framebuf
+import asyncio
+from display_drivers import AsyncDisplayDriver
+
+class FrameBuffer():
+    """ Front and back MONO_VLSB buffers for the display drivers. The application draws
+    into back, swap() makes it the front and hands it to a flush task while drawing
+    goes on in the other buffer. """
+
+    def __init__(self, driver, width, height) -> None:
+        """ driver : display driver, its print_buffer may be sync or async. With a PioKs0108
+        in DMA mode the frame is sent in the background by the DMA.
+        """
+        self._driver = driver
+        self._width = width
+        self._height = height
+
+        size = width * (height // 8)
+        self._buffers = (bytearray(size), bytearray(size))
+        self._framebufs = (framebuf.FrameBuffer(self._buffers[0], width, height, framebuf.MONO_VLSB),
+                           framebuf.FrameBuffer(self._buffers[1], width, height, framebuf.MONO_VLSB))
+        self._back = 0
+
+        self._ready = asyncio.Event()
+        self._flushed = asyncio.Event()
+        self._flushed.set()
+        self._task = None
+
+    @property
+    def back(self):
+        """ framebuf.FrameBuffer to draw into """
+        return self._framebufs[self._back]
+
+    @property
+    def back_buffer(self):
+        return self._buffers[self._back]
+
+    @property
+    def front_buffer(self):
+        """ Buffer of the last frame given to swap(), must not be modified """
+        return self._buffers[self._back ^ 1]
+
+    def start(self):
+        """ Starts the flush task """
+        if self._task == None:
+            self._task = asyncio.create_task(self._flusher())
+
+    def stop(self):
+        if self._task != None:
+            self._task.cancel()
+            self._task = None
+
+    async def swap(self, copy=True):
+        """ Waits for the previous flush, then makes back the front and starts flushing it.
+        copy : the new back starts as a copy of the new front, for incremental drawing """
+        await self.wait()
+        self._back ^= 1
+        if copy:
+            self._buffers[self._back][:] = self._buffers[self._back ^ 1]
+        self._flushed.clear()
+        self._ready.set()
+
+    async def wait(self):
+        """ Waits for the front buffer to be sent """
+        await self._flushed.wait()
+
+    async def _flusher(self):
+        driver = self._driver
+        is_async = isinstance(driver, AsyncDisplayDriver)
+        # PioKs0108 in DMA mode: the DMA stream is reused, the previous frame must be out
+        dma = getattr(driver, '_dma', False)
+        while True:
+            await self._ready.wait()
+            self._ready.clear()
+            if dma:
+                await driver.wait()
+            if is_async:
+                await driver.print_buffer(self._buffers[self._back ^ 1])
+            else:
+                driver.print_buffer(self._buffers[self._back ^ 1])
+            self._flushed.set()
@@ -0,0 +1,8 @@
+def log2_bucket(us, buckets):
+    """ Index of a duration in a log2 histogram of the given number of buckets: bucket n
+    counts durations in [2^(n-1), 2^n) us, the last one everything longer. Does not allocate. """
+    bucket = 0
+    while us > 0 and bucket < buckets - 1:
+        us >>= 1
+        bucket += 1
+    return bucket
@@ -1,13 +1,19 @@
 from machine import Pin
 import asyncio
 import time
-from display_drivers import DisplayDriver
+from display_drivers import AsyncDisplayDriver
+from ks0108_spans import changed_spans, Ks0108Addresses, SET_PAGE, SET_COLUMN, COMMANDS
 
 LCD_ON=0x3f
 LCD_OFF=0x3e
 LCD_DISPLAY_START=0xc0
 
-class AsyncKs0108(DisplayDriver):
+class AsyncKs0108(Ks0108Addresses, AsyncDisplayDriver):
+    """ KS0108 driver flushing from an asyncio task. Frames given to submit() go through a
+    latest-frame-wins slot: a frame not yet picked up by the flush task is replaced and
+    counted in dropped. The bus is polled for busy once per chip page and the task yields
+    to the loop between pages. """
+
     def __init__(self,
                  width, height,
                  e: Pin,
@@ -29,6 +35,29 @@ class AsyncKs0108(DisplayDriver):
         self._data = data
         self._reset = reset
 
+        self._init_addresses()
+        # Address commands and bus cycles of the last flush
+        self._commands = 0
+        self._transactions = 0
+        self._data_dir = None
+
+        # Latest-frame-wins slot: submit() copies into _pending, the flush task swaps it
+        # with _frame and sends _frame
+        size = width * (height // 8)
+        self._pending = bytearray(size)
+        self._frame = bytearray(size)
+        self._has_pending = False
+        self._sending = False
+        self._ready = asyncio.Event()
+        self._flushed = asyncio.Event()
+        self._task = None
+
+        self.frames = 0
+        self.dropped = 0
+        self.fps = 0
+        self._fps_frames = 0
+        self._fps_start = time.ticks_ms()
+
     async def init(self):
         self._e.init(Pin.OUT)
         self._rs.init(Pin.OUT)
@@ -51,15 +80,84 @@ class AsyncKs0108(DisplayDriver):
         for i in range(self._chips):
             await self._write_command(LCD_ON, i)
             await self._write_command(LCD_DISPLAY_START, i)
+        self._start_line = 0
+        self.invalidate()
 
         buffer = bytearray(self._width * (self._height // 8))
-        await self._write_framebuffer(buffer)
+        await self._flush(buffer)
 
-    async def print_buffer(self, buffer: bytearray):
-        await self._write_framebuffer(buffer)
+    def start(self):
+        """ Starts the flush task serving submit() """
+        if self._task == None:
+            self._task = asyncio.create_task(self._flusher())
+
+    def stop(self):
+        if self._task != None:
+            self._task.cancel()
+            self._task = None
+
+    def submit(self, buffer: bytearray):
+        """ Queues a copy of buffer for the flush task and returns at once. A frame still
+        waiting in the slot is replaced and counted in dropped """
+        if self._has_pending:
+            self.dropped += 1
+        self._pending[:] = buffer
+        self._has_pending = True
+        self._flushed.clear()
+        self._ready.set()
+
+    async def flushed(self):
+        """ Waits until the last submitted frame has been sent """
+        while self._has_pending or self._sending:
+            await self._flushed.wait()
+
+    async def _flusher(self):
+        while True:
+            await self._ready.wait()
+            self._ready.clear()
+            if not self._has_pending:
+                continue
+            self._pending, self._frame = self._frame, self._pending
+            self._has_pending = False
+            self._sending = True
+            await self.print_buffer(self._frame)
+            self._sending = False
+            self._count_frame()
+            if not self._has_pending:
+                self._flushed.set()
+
+    def _count_frame(self):
+        self.frames += 1
+        self._fps_frames += 1
+        now = time.ticks_ms()
+        elapsed = time.ticks_diff(now, self._fps_start)
+        if elapsed >= 1000:
+            self.fps = self._fps_frames * 1000 / elapsed
+            self._fps_frames = 0
+            self._fps_start = now
+
+    async def write_at(self, page, column, data):
+        """ Writes data from column of page and updates the copy of the frame, sending only
+        the address commands the controller pointers need. Returns the number of bytes sent """
+        sent = 0
+        for chip, start, end, index in self._spans_at(page, column, len(data)):
+            await self._wait_ready(chip)
+            sent += self._write_span(data, index - start, start, end, chip, page) + end - start
+            self._shadow_at(data, index, start, end, chip, page)
+        return sent
+
+    async def set_start_line(self, line):
+        """ Shows the display RAM from line on the top row (hardware vertical scrolling) """
+        self._start_line = line % self._height
+        for chip in range(self._chips):
+            await self._write_command(LCD_DISPLAY_START | self._start_line, chip)
 
     async def _write_command(self, cmd, chip):
         await self._wait_ready(chip)
+        self._send_command(cmd, chip)
+
+    def _send_command(self, cmd, chip):
+        # The chip must have been found ready
         self._set_data_direction(Pin.OUT)
         self._set_cs(chip)
         self._rs.low()
@@ -68,17 +166,6 @@ class AsyncKs0108(DisplayDriver):
         self._set_data_value(cmd)
         self._en()
 
-    async def _write_data(self, data, chip):
-        await self._wait_ready(chip)
-        self._set_data_direction(Pin.OUT)
-        self._set_cs(chip)
-        self._rs.high()
-        self._rw.low()
-
-        self._set_data_value(data)
-        self._en()
-
-
     async def _wait_ready(self, chip):
         self._set_data_direction(Pin.IN)
         self._set_cs(chip)
@@ -99,6 +186,9 @@ class AsyncKs0108(DisplayDriver):
                 self._cs[i].low()
 
     def _set_data_direction(self, dir):
+        if dir == self._data_dir:
+            return
+        self._data_dir = dir
         for i in range(len(self._data)):
             self._data[i].init(dir, Pin.PULL_DOWN)
 
@@ -113,15 +203,57 @@ class AsyncKs0108(DisplayDriver):
         time.sleep_us(1)
         self._e.low()
 
-    async def _write_framebuffer(self, buffer: bytearray):
+    async def _flush(self, buffer: bytearray):
+        """ Sends the parts of buffer that changed since the last call """
+        sent = 0
+        commands = 0
+        full = self._shadow == None
+        if full:
+            self._shadow = bytearray(len(buffer))
+        shadow = self._shadow
+        src = memoryview(buffer)
         for page in range(self._pages):
             for chip in range(self._chips):
-                addr = 0xb8 | (0x07 & page)
-                await self._write_command(addr, chip)
-                await self._write_command(0x40, chip)
-                await self._write_page(buffer, page, chip)
-    
-    async def _write_page(self, buffer: bytearray, page, chip):
-        for i in range(64):
-            val = buffer[i + (64 * chip) + (page * self._width)]
-            await self._write_data(val, chip)
+                offset = (64 * chip) + (page * self._width)
+                spans = ((0, 64),) if full else changed_spans(buffer, shadow, offset)
+                ready = False
+                for start, end in spans:
+                    # One busy check per chip page, the bytes are then written back to back
+                    if not ready:
+                        await self._wait_ready(chip)
+                        ready = True
+                    count = self._write_span(buffer, offset, start, end, chip, page)
+                    sent += count + end - start
+                    commands += count
+                    # The copy follows each span as it is sent: a write_at() of another task
+                    # while this one waits must not be overwritten by the end of the flush
+                    shadow[offset + start:offset + end] = src[offset + start:offset + end]
+            # Let the other tasks run between pages
+            await asyncio.sleep_ms(0)
+        # One e strobe per byte, busy polls not included
+        self._commands = commands
+        self._transactions = sent
+        return sent
+
+    def _write_span(self, buffer, offset, start, end, chip, page):
+        # Addresses the chip if needed then writes the bytes, returns the commands sent.
+        # The chip must have been found ready
+        self._set_data_direction(Pin.OUT)
+        self._set_cs(chip)
+        self._rw.low()
+        address = self._address(chip, page, start, end)
+        if address & SET_PAGE:
+            self._send_command(0xb8 | (0x07 & page), chip)
+        if address & SET_COLUMN:
+            self._send_command(0x40 | start, chip)
+        self._write_page(buffer, offset, start, end, chip)
+        return COMMANDS[address]
+
+    def _write_page(self, buffer: bytearray, offset, start, end, chip):
+        data = self._data
+        self._rs.high()
+        for i in range(offset + start, offset + end):
+            value = buffer[i]
+            for bit in range(8):
+                data[bit].value((value >> bit) & 0x01)
+            self._en()
@@ -1,11 +1,18 @@
 from machine import Pin, mem32
+from array import array
 import time
+from display_drivers import DisplayDriver
+from ks0108_spans import changed_spans, Ks0108Addresses, SET_PAGE, SET_COLUMN, COMMANDS
 
 LCD_ON=0x3f
 LCD_OFF=0x3e
 LCD_DISPLAY_START=0xc0
 
-class Ks0108():
+# RP2040 SIO atomic output registers
+GPIO_OUT_SET=0xd0000014
+GPIO_OUT_CLR=0xd0000018
+
+class Ks0108(Ks0108Addresses, DisplayDriver):
     def __init__(self,
                  width, height,
                  e: Pin,
@@ -13,7 +20,11 @@ class Ks0108():
                  rs: Pin,
                  rw: Pin,
                  reset: Pin,
-                 data: list[Pin]) -> None:
+                 data: list[Pin],
+                 e_gpio: int = None,
+                 data_gpios: list[int] = None) -> None:
+        """ e_gpio, data_gpios : GPIO numbers of the e and data pins. When given, bytes are
+        written with SIO set/clear register writes instead of Pin calls """
         self._width = width
         self._height = height
 
@@ -27,6 +38,30 @@ class Ks0108():
         self._data = data
         self._reset = reset
 
+        self._init_addresses()
+        # Address commands and bus cycles of the last flush
+        self._commands = 0
+        self._transactions = 0
+
+        # Fast mode: per data byte, the GPIO mask to clear and the one to set (with e)
+        self._clr_masks = None
+        self._set_masks = None
+        self._e_mask = 0
+        if e_gpio != None and data_gpios != None:
+            self._e_mask = 1 << e_gpio
+            self._clr_masks = array('I', [0] * 256)
+            self._set_masks = array('I', [0] * 256)
+            for value in range(256):
+                set_mask = self._e_mask
+                clr_mask = 0
+                for i in range(8):
+                    if (value >> i) & 0x01:
+                        set_mask |= 1 << data_gpios[i]
+                    else:
+                        clr_mask |= 1 << data_gpios[i]
+                self._clr_masks[value] = clr_mask
+                self._set_masks[value] = set_mask
+
     def init(self):
         self._e.init(Pin.OUT)
         self._rs.init(Pin.OUT)
@@ -52,9 +87,28 @@ class Ks0108():
             self._set_cs(i)
             self._write_command(LCD_ON, i)
             self._write_command(LCD_DISPLAY_START, i)
-
-    def print_buffer(self, buffer):
-        self._write_framebuffer(buffer)
+        self._start_line = 0
+        self.invalidate()
+
+    def write_at(self, page, column, data):
+        """ Writes data from column of page and updates the copy of the frame, sending only
+        the address commands the controller pointers need. Returns the number of bytes sent """
+        sent = 0
+        spans = self._spans_at(page, column, len(data))
+        self._rw.low()
+        for chip, start, end, index in spans:
+            sent += self._write_span(data, index - start, start, end, chip, page) + end - start
+            self._shadow_at(data, index, start, end, chip, page)
+        return sent
+
+    def set_start_line(self, line):
+        """ Shows the display RAM from line on the top row (hardware vertical scrolling) """
+        self._start_line = line % self._height
+        self._rw.low()
+        for chip in range(self._chips):
+            self._set_cs(chip)
+            self._rs.low()
+            self._write_command(LCD_DISPLAY_START | self._start_line, chip)
 
     def _write_command(self, cmd, chip):
         # No need to wait ready as the code is way slower than the LCD
@@ -67,6 +121,9 @@ class Ks0108():
         #self._rs.low()
         #self._rw.low()
 
+        if self._set_masks != None:
+            self._strobe(cmd)
+            return
         self._set_data_value(cmd)
         self._en()
 
@@ -81,9 +138,18 @@ class Ks0108():
         #self._rs.high()
         #self._rw.low()
 
+        if self._set_masks != None:
+            self._strobe(data)
+            return
         self._set_data_value(data)
         self._en()
 
+    def _strobe(self, value):
+        # Data bits and e rise together, e falls alone: the byte is latched on the falling edge
+        mem32[GPIO_OUT_CLR] = self._clr_masks[value]
+        mem32[GPIO_OUT_SET] = self._set_masks[value]
+        mem32[GPIO_OUT_CLR] = self._e_mask
+
 
     def _wait_ready(self, chip):
         self._set_data_direction(Pin.IN)
@@ -119,17 +185,51 @@ class Ks0108():
         #time.sleep_us(1)
         self._e.low()
 
-    def _write_framebuffer(self, buffer):
+    def _flush(self, buffer):
+        """ Sends the parts of buffer that changed since the last call """
+        sent = 0
+        commands = 0
+        full = self._shadow == None
+        if full:
+            self._shadow = bytearray(len(buffer))
         self._rw.low()
         for page in range(self._pages):
             for chip in range(self._chips):
-                self._set_cs(chip)
-                self._rs.low()
-                self._write_command(0xb8 | (0x07 & page), chip)
-                self._write_command(0x40, chip)
-                self._write_page(buffer, page, chip)
-    
-    def _write_page(self, buffer, page, chip):
+                offset = (64 * chip) + (page * self._width)
+                spans = ((0, 64),) if full else changed_spans(buffer, self._shadow, offset)
+                for start, end in spans:
+                    count = self._write_span(buffer, offset, start, end, chip, page)
+                    sent += count + end - start
+                    commands += count
+        self._shadow[:] = buffer
+        # One e strobe per byte
+        self._commands = commands
+        self._transactions = sent
+        return sent
+
+    def _write_span(self, buffer, offset, start, end, chip, page):
+        # Addresses the chip if needed then writes the bytes, returns the commands sent
+        self._set_cs(chip)
+        self._rs.low()
+        address = self._address(chip, page, start, end)
+        if address & SET_PAGE:
+            self._write_command(0xb8 | (0x07 & page), chip)
+        if address & SET_COLUMN:
+            self._write_command(0x40 | start, chip)
+        self._write_page(buffer, offset, start, end, chip)
+        return COMMANDS[address]
+
+    def _write_page(self, buffer, offset, start, end, chip):
         self._rs.high()
-        for i in range(64):
-            self._write_data(buffer[i + (64 * chip) + (page * self._width)], chip)
+        if self._set_masks != None:
+            clr_masks = self._clr_masks
+            set_masks = self._set_masks
+            e_mask = self._e_mask
+            for i in range(offset + start, offset + end):
+                value = buffer[i]
+                mem32[GPIO_OUT_CLR] = clr_masks[value]
+                mem32[GPIO_OUT_SET] = set_masks[value]
+                mem32[GPIO_OUT_CLR] = e_mask
+            return
+        for i in range(offset + start, offset + end):
+            self._write_data(buffer[i], chip)
@@ -0,0 +1,55 @@
+import framebuf
+
+class ScrollView():
+    """ Screen coordinates view of a frame buffer scrolled with the display start line.
+    The buffer holds the display RAM: screen line y is RAM line (y + start) % height.
+    After scroll(8), the page row that left the top is the new bottom row, so clearing and
+    drawing it then calling flush() sends only that page, the other pages being unchanged. """
+
+    def __init__(self, driver, width, height) -> None:
+        """ driver : KS0108 driver with set_start_line(), sync or async """
+        self._driver = driver
+        self._width = width
+        self._height = height
+        self.buffer = bytearray(width * (height // 8))
+        self.fbuf = framebuf.FrameBuffer(self.buffer, width, height, framebuf.MONO_VLSB)
+        self.start = 0
+
+    def line(self, y):
+        """ RAM line of screen line y """
+        return (y + self.start) % self._height
+
+    def scroll(self, lines):
+        """ Moves the content up by lines (down when negative). Returns the driver's
+        set_start_line() result, to be awaited with an async driver """
+        self.start = (self.start + lines) % self._height
+        return self._driver.set_start_line(self.start)
+
+    def flush(self):
+        """ Sends the buffer, the result is to be awaited with an async driver """
+        return self._driver.print_buffer(self.buffer)
+
+    def pixel(self, x, y, c=None):
+        if c == None:
+            return self.fbuf.pixel(x, self.line(y))
+        self.fbuf.pixel(x, self.line(y), c)
+
+    def fill_rect(self, x, y, w, h, c):
+        # Split where the screen rectangle wraps around the end of the RAM
+        y = self.line(y)
+        first = min(h, self._height - y)
+        self.fbuf.fill_rect(x, y, w, first, c)
+        if first < h:
+            self.fbuf.fill_rect(x, 0, w, h - first, c)
+
+    def clear_lines(self, y, h):
+        """ Clears h screen lines from y, e.g. the row exposed by a scroll """
+        self.fill_rect(0, y, self._width, h, 0)
+
+    def text(self, s, x, y, c=1):
+        # The 8 lines high glyphs are drawn twice when they cross the RAM end, the
+        # frame buffer clips each part
+        y = self.line(y)
+        self.fbuf.text(s, x, y, c)
+        if y + 8 > self._height:
+            self.fbuf.text(s, x, y - self._height, c)
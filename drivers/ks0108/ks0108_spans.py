@@ -0,0 +1,101 @@
+# Changed column spans between a framebuffer and the copy last sent to a KS0108.
+#
+# The drivers track the page and column address of each controller, so within a
+# page starting a new span costs a column address command: an unchanged byte
+# between two changes is resent when it is alone (MERGE_GAP), which costs the
+# same and keeps the spans fewer.
+
+MERGE_GAP = 1
+
+# Address register value of a controller whose pointer is unknown
+NO_ADDRESS = 0xff
+
+# Address commands a span needs, see Ks0108Addresses._address()
+SET_PAGE = 0x01
+SET_COLUMN = 0x02
+# Number of commands of each _address() result
+COMMANDS = (0, 1, 1, 2)
+
+def changed_spans(buffer, shadow, offset, length=64, merge_gap=MERGE_GAP):
+    """ Yields the (start, end) columns, end excluded, of buffer[offset:offset + length]
+    that differ from shadow, merging spans separated by merge_gap bytes or less """
+    start = -1
+    end = -1
+    for col in range(length):
+        i = offset + col
+        if buffer[i] != shadow[i]:
+            if start < 0:
+                start = col
+            elif col - end > merge_gap:
+                yield (start, end)
+                start = col
+            end = col + 1
+    if start >= 0:
+        yield (start, end)
+
+def chip_spans(column, length, width):
+    """ Yields the (chip, start, end, index) pieces of length bytes written from column of a
+    page row: start and end are chip columns, end excluded, index is the position in the data """
+    if column < 0 or column + length > width:
+        raise ValueError('columns {} to {} out of the display'.format(column, column + length))
+    index = 0
+    while index < length:
+        chip = (column + index) // 64
+        start = (column + index) % 64
+        end = min(64, start + length - index)
+        yield (chip, start, end, index)
+        index += end - start
+
+class Ks0108Addresses():
+    """ Copy of the frame, start line and address registers of the controllers, shared by
+    the KS0108 drivers. Needs _width, _height, _pages and _chips, and _init_addresses()
+    called from __init__. set_start_line() is the driver's, sync or async. """
+
+    def _init_addresses(self):
+        # Copy of the last frame sent, None when the display content is unknown
+        self._shadow = None
+        # Display RAM line shown on the top row
+        self._start_line = 0
+        # Page and column address registers of each controller
+        self._page_addr = bytearray([NO_ADDRESS] * self._chips)
+        self._column_addr = bytearray([NO_ADDRESS] * self._chips)
+
+    def invalidate(self):
+        """ Forces the next print_buffer to send the whole frame """
+        self._shadow = None
+        self._forget_addresses()
+
+    def scroll(self, lines):
+        """ Moves the content up by lines (down when negative). Returns the result of
+        set_start_line(), to be awaited with an async driver """
+        return self.set_start_line(self._start_line + lines)
+
+    def _forget_addresses(self):
+        for chip in range(self._chips):
+            self._page_addr[chip] = NO_ADDRESS
+            self._column_addr[chip] = NO_ADDRESS
+
+    def _address(self, chip, page, start, end):
+        """ Returns the SET_PAGE and SET_COLUMN bits of the commands needed before writing the
+        columns start to end of page, and tracks the registers as they are after the span """
+        commands = 0
+        if self._page_addr[chip] != page:
+            self._page_addr[chip] = page
+            commands |= SET_PAGE
+        if self._column_addr[chip] != start:
+            commands |= SET_COLUMN
+        # The column address increments after each byte and wraps
+        self._column_addr[chip] = end & 0x3f
+        return commands
+
+    def _spans_at(self, page, column, length):
+        """ chip_spans() of a write_at(), checked before anything is sent """
+        if page < 0 or page >= self._pages:
+            raise ValueError('page {} out of the display'.format(page))
+        return chip_spans(column, length, self._width)
+
+    def _shadow_at(self, data, index, start, end, chip, page):
+        # Keeps the copy of the frame in step with a write_at() span
+        if self._shadow != None:
+            offset = (64 * chip) + (page * self._width)
+            self._shadow[offset + start:offset + end] = data[index:index + end - start]
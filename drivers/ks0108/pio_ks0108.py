@@ -1,6 +1,9 @@
 import rp2
 from machine import Pin
+import asyncio
 import time
+from display_drivers import DisplayDriver
+from ks0108_spans import changed_spans, Ks0108Addresses, SET_PAGE, SET_COLUMN, COMMANDS
 
 # Two state machines: 
 #   - data output: sets the data pins and toggles the en pin to latch the data
@@ -19,16 +22,57 @@ def ks0108_ctrl_output():
     out(pins, 4)                [4]
     wrap()
 
+# DMA mode: the same two state machines, fed by two DMA channels from a precompiled
+# stream. The data stream is made of segments: a byte count minus one followed by
+# the bytes. Before each segment the data state machine raises irq 4 and waits for
+# the ctrl state machine to apply the next ctrl word, keeping both streams in step.
+
+@rp2.asm_pio(out_init=[rp2.PIO.OUT_LOW] * 8, sideset_init=rp2.PIO.OUT_LOW, out_shiftdir=rp2.PIO.SHIFT_RIGHT)
+def ks0108_data_stream():
+    wrap_target()
+    pull()                      .side(0)
+    out(x, 8)                   .side(0)
+    irq(block, 4)               .side(0)    [7]
+    label("byte")
+    pull()                      .side(0)
+    out(pins, 8)                .side(1)    [4]
+    jmp(x_dec, "byte")          .side(0)    [3]
+    wrap()
+
+@rp2.asm_pio(out_init=[rp2.PIO.OUT_LOW] * 4, out_shiftdir=rp2.PIO.SHIFT_RIGHT)
+def ks0108_ctrl_stream():
+    wrap_target()
+    wait(1, irq, 4)
+    pull()
+    out(pins, 4)
+    wrap()
+
 LCD_ON=0x3f
 LCD_OFF=0x3e
 LCD_DISPLAY_START=0xc0
-class PioKs0108():
+
+DATA_SM=1
+CTRL_SM=2
+
+def _tx_fifo(sm):
+    # TXF0 of PIO0/PIO1, one register per state machine
+    return (0x50200010, 0x50300010)[sm // 4] + 4 * (sm % 4)
+
+def _tx_dreq(sm):
+    return (sm // 4) * 8 + (sm % 4)
+
+class PioKs0108(Ks0108Addresses, DisplayDriver):
     def __init__(self,
                  width, height,
                  ctrl_first_pin: Pin, # First control pins in the order rw, rs, cs0, cs1
                  en_pin: Pin,
                  data_first_pin: Pin, # First data pin of 8
-                 reset: Pin) -> None:
+                 reset: Pin,
+                 dma=False,
+                 flush_callback=None) -> None:
+        """ dma : stream whole frames through DMA, print_buffer returns before the frame is sent
+        flush_callback : called with the driver when a DMA frame has been sent
+        """
         self._width = width
         self._height = height
 
@@ -40,17 +84,56 @@ class PioKs0108():
         self._data_first_pin = data_first_pin 
         self._reset = reset
 
+        self._init_addresses()
+        # Address commands and FIFO words (or DMA transfers) of the last flush
+        self._commands = 0
+        self._transactions = 0
+
         self._en_pin.init(Pin.OUT)
 
-        self._data_sm = rp2.StateMachine(1, ks0108_data_output, freq=4000000, sideset_base=self._en_pin, out_base=self._data_first_pin)
-        self._ctrl_sm = rp2.StateMachine(2, ks0108_ctrl_output, freq=4000000, out_base=self._ctrl_first_pin)
+        self._dma = dma
+        data_program = ks0108_data_stream if dma else ks0108_data_output
+        ctrl_program = ks0108_ctrl_stream if dma else ks0108_ctrl_output
+        self._data_sm = rp2.StateMachine(DATA_SM, data_program, freq=4000000, sideset_base=self._en_pin, out_base=self._data_first_pin)
+        self._ctrl_sm = rp2.StateMachine(CTRL_SM, ctrl_program, freq=4000000, out_base=self._ctrl_first_pin)
+
+        if dma:
+            self._init_dma(flush_callback)
 
         self._data_sm.active(1)
         self._ctrl_sm.active(1)
 
+    def _init_dma(self, flush_callback):
+        # Per page and chip: a 2 bytes command segment then a 64 bytes data segment
+        segments = self._pages * self._chips
+        self._data_stream = bytearray(segments * 68)
+        self._ctrl_stream = bytearray(segments * 2)
+        self._data_stream_view = memoryview(self._data_stream)
+        pos = 0
+        for page in range(self._pages):
+            for chip in range(self._chips):
+                self._ctrl_stream[2 * (pos // 68)] = 1 << (chip + 2)
+                self._ctrl_stream[2 * (pos // 68) + 1] = 0x2 | (1 << chip + 2)
+                self._data_stream[pos] = 1
+                self._data_stream[pos + 1] = 0xb8 | (0x07 & page)
+                self._data_stream[pos + 2] = 0x40
+                self._data_stream[pos + 3] = 63
+                pos += 68
+
+        self._flush_callback = flush_callback
+        self._flushed = asyncio.ThreadSafeFlag()
+        self._data_dma = rp2.DMA()
+        self._ctrl_dma = rp2.DMA()
+        self._data_dma_ctrl = self._data_dma.pack_ctrl(size=0, inc_write=False, treq_sel=_tx_dreq(DATA_SM), irq_quiet=False)
+        self._ctrl_dma_ctrl = self._ctrl_dma.pack_ctrl(size=0, inc_write=False, treq_sel=_tx_dreq(CTRL_SM))
+        self._data_dma.irq(self._dma_done)
+
     def init(self):
         self._en_pin.low()
-        self._ctrl_sm.put(0x0)
+        if self._dma:
+            self._wait_dma()
+        else:
+            self._ctrl_sm.put(0x0)
 
         if self._reset != None:
             self._reset.init(Pin.OUT)
@@ -60,6 +143,16 @@ class PioKs0108():
             time.sleep_us(1)
             self._reset.high()
 
+        self._start_line = 0
+        self.invalidate()
+        if self._dma:
+            for ctrl in (0x4, 0x8):
+                self._data_sm.put(1)
+                self._ctrl_sm.put(ctrl)
+                self._data_sm.put(LCD_ON)
+                self._data_sm.put(LCD_DISPLAY_START)
+            return
+
         self._ctrl_sm.put(0x4)
         self._data_sm.put(LCD_ON)
         self._data_sm.put(LCD_DISPLAY_START)
@@ -68,21 +161,125 @@ class PioKs0108():
         self._data_sm.put(LCD_ON)
         self._data_sm.put(LCD_DISPLAY_START)
 
-    def print_buffer(self, buffer):
-        start = time.ticks_us()
-        self._write_framebuffer(buffer)
-        #print('writing framebuffer took {}us'.format(time.ticks_diff(time.ticks_us(), start)))
+    def _flush(self, buffer):
+        """ Sends the parts of buffer that changed since the last call. In DMA mode the
+        duration recorded in stats is the time to start the transfer """
+        if self._dma:
+            return self._start_dma(buffer)
+        return self._write_framebuffer(buffer)
+
+    def write_at(self, page, column, data):
+        """ Writes data from column of page and updates the copy of the frame, sending only
+        the address commands the controller pointers need. Returns the number of bytes sent.
+        In DMA mode, waits for the frame in progress """
+        spans = self._spans_at(page, column, len(data))
+        if self._dma:
+            self._wait_dma()
+        sent = 0
+        for chip, start, end, index in spans:
+            sent += self._write_span(data, index - start, start, end, chip, page) + end - start
+            self._shadow_at(data, index, start, end, chip, page)
+        return sent
+
+    def set_start_line(self, line):
+        """ Shows the display RAM from line on the top row (hardware vertical scrolling).
+        In DMA mode, waits for the frame in progress """
+        self._start_line = line % self._height
+        if self._dma:
+            self._wait_dma()
+        for chip in range(self._chips):
+            if self._dma:
+                # One byte segment
+                self._data_sm.put(0)
+            self._ctrl_sm.put(1 << (chip + 2))
+            self._data_sm.put(LCD_DISPLAY_START | self._start_line)
+
+    def busy(self):
+        """ True while a DMA frame is being sent """
+        return self._dma and (self._data_dma.active() or self._ctrl_dma.active())
+
+    async def wait(self):
+        """ Waits for the DMA frame in progress to be sent """
+        while self.busy():
+            await self._flushed.wait()
+
+    def _wait_dma(self):
+        while self.busy():
+            pass
+
+    def _dma_done(self, dma):
+        self._flushed.set()
+        if self._flush_callback != None:
+            self._flush_callback(self)
+
+    def _start_dma(self, buffer):
+        # The stream is reused, the previous frame must be out first
+        self._wait_dma()
+        src = memoryview(buffer)
+        stream = self._data_stream_view
+        pos = 4
+        for page in range(self._pages):
+            for chip in range(self._chips):
+                offset = (64 * chip) + (page * self._width)
+                stream[pos:pos + 64] = src[offset:offset + 64]
+                pos += 68
+        if self._shadow == None:
+            self._shadow = bytearray(len(buffer))
+        self._shadow[:] = buffer
+
+        self._ctrl_dma.config(read=self._ctrl_stream, write=_tx_fifo(CTRL_SM), count=len(self._ctrl_stream), ctrl=self._ctrl_dma_ctrl, trigger=True)
+        self._data_dma.config(read=self._data_stream, write=_tx_fifo(DATA_SM), count=len(self._data_stream), ctrl=self._data_dma_ctrl, trigger=True)
+        self._commands = self._pages * self._chips * 2
+        self._transactions = 2
+        # Every segment addresses its page from column 0 and fills it
+        for chip in range(self._chips):
+            self._page_addr[chip] = self._pages - 1
+            self._column_addr[chip] = 0
+        return self._pages * self._chips * 66
 
     def _write_framebuffer(self, buffer):
+        sent = 0
+        commands = 0
+        ctrl_words = 0
+        full = self._shadow == None
+        if full:
+            self._shadow = bytearray(len(buffer))
         for page in range(self._pages):
             for chip in range(self._chips):
-                self._ctrl_sm.put(1 << (chip + 2))
+                offset = (64 * chip) + (page * self._width)
+                spans = ((0, 64),) if full else changed_spans(buffer, self._shadow, offset)
+                for start, end in spans:
+                    count = self._write_span(buffer, offset, start, end, chip, page)
+                    sent += count + end - start
+                    commands += count
+                    # The ctrl words of the span
+                    ctrl_words += 2 if count else 1
+        self._shadow[:] = buffer
+        # A FIFO word per byte plus the ctrl words
+        self._commands = commands
+        self._transactions = sent + ctrl_words
+        return sent
+
+    def _write_span(self, buffer, offset, start, end, chip, page):
+        # Addresses the chip if needed then writes the bytes, returns the commands sent.
+        # In DMA mode the state machines run the stream programs: each group of bytes is
+        # a segment preceded by its count minus one
+        address = self._address(chip, page, start, end)
+        commands = COMMANDS[address]
+        if commands:
+            if self._dma:
+                self._data_sm.put(commands - 1)
+            self._ctrl_sm.put(1 << (chip + 2))
+            if address & SET_PAGE:
                 self._data_sm.put(0xb8 | (0x07 & page))
-                self._data_sm.put(0x40)
-                self._write_page(buffer, page, chip)
-    
-    def _write_page(self, buffer, page, chip):
+            if address & SET_COLUMN:
+                self._data_sm.put(0x40 | start)
+        if self._dma:
+            self._data_sm.put(end - start - 1)
+        self._write_page(buffer, offset, start, end, chip)
+        return commands
+
+    def _write_page(self, buffer, offset, start, end, chip):
         self._ctrl_sm.put(0x2 | (1 << chip + 2))
-        for i in range(64):
-            # use DMA instead?
-            self._data_sm.put(buffer[i + (64 * chip) + (page * self._width)])
+        for i in range(offset + start, offset + end):
+            self._data_sm.put(buffer[i])
@@ -1,5 +1,8 @@
 from machine import Pin
+from array import array
 import time
+from display_drivers import DisplayDriver
+from ks0108_spans import changed_spans, Ks0108Addresses, MERGE_GAP, SET_PAGE, SET_COLUMN, COMMANDS
 
 LCD_ON=0x3f
 LCD_OFF=0x3e
@@ -22,16 +25,18 @@ B_5=0x2000
 B_6=0x4000
 B_7=0x8000
 
-class SpiKs0108():
+class SpiKs0108(Ks0108Addresses, DisplayDriver):
     def __init__(self,
                  width, height,
                  ioext,
-                 e: Pin,
+                 e,
                  cs: list[int],
                  rs: int,
                  rw: int,
                  reset: int,
                  data: list[int]) -> None:
+        """ e : MCU Pin of the e line, or its expander bit (A_x/B_x) when it is wired to the
+        expander. In the latter case each page is sent in one MCP23S17.stream_gpio() burst """
         self._width = width
         self._height = height
         self._ioext = ioext
@@ -46,13 +51,40 @@ class SpiKs0108():
         self._data = data
         self._reset = reset
 
-        self._write_command_ticks = 0
-        self._write_data_ticks = 0
-        self._write_data_count = 0
-        #self._spi_ticks = 0
-        #self._set_data_value_ticks = 0
         self._txdata = 0x0000
 
+        self._init_addresses()
+        # Address commands and expander transfers of the last flush
+        self._commands = 0
+        self._transactions = 0
+
+        # The expander word of a bus cycle is a data word ORed with a control word:
+        # the data pins for every byte, and per chip the cs pins with rs low (command)
+        # or high (data). rw stays low.
+        self._data_words = array('H', [0] * 256)
+        for value in range(256):
+            word = 0
+            for i in range(8):
+                if (value >> i) & 1:
+                    word |= self._data[i]
+            self._data_words[value] = word
+        self._command_words = array('H', [0] * self._chips)
+        self._data_ctrl_words = array('H', [0] * self._chips)
+        for chip in range(self._chips):
+            self._command_words[chip] = self._cs[chip]
+            self._data_ctrl_words[chip] = self._cs[chip] | self._rs
+
+        # Burst mode: e is an expander bit and each page is rendered as the sequence of
+        # expander words of its bus cycles, each cycle being a high/low e pair
+        self._e_mask = e if isinstance(e, int) else 0
+        if self._e_mask:
+            # Worst case per chip: a page command with its setup word, then as many spans
+            # as the merge rule allows, each with a column command and its setup word, plus
+            # a setup word and a cycle per data byte
+            spans = (64 + MERGE_GAP) // (MERGE_GAP + 1)
+            self._burst = array('H', [0] * (self._chips * (3 + spans * 4 + 2 * 64)))
+            self._burst_view = memoryview(self._burst)
+
     def _set_txdata_bit(self, pin, val):
         if val == 1:
             self._txdata = self._txdata | pin
@@ -60,11 +92,13 @@ class SpiKs0108():
             self._txdata = self._txdata & ~pin
 
     def init(self):
-        self._e.init(Pin.OUT)
+        if not self._e_mask:
+            self._e.init(Pin.OUT)
 
         self._set_txdata_bit(self._rs, 0)
         self._set_txdata_bit(self._rw, 0)
-        self._e.low()
+        if not self._e_mask:
+            self._e.low()
 
         #if self._reset != None:
         #    self._set_txdata_bit(self._reset)
@@ -76,74 +110,147 @@ class SpiKs0108():
         for i in range(self._chips):
             self._write_command(LCD_ON, i)
             self._write_command(LCD_DISPLAY_START, i)
+        self._start_line = 0
+        self.invalidate()
+
+    def write_at(self, page, column, data):
+        """ Writes data from column of page and updates the copy of the frame, sending only
+        the address commands the controller pointers need. Returns the number of bytes sent.
+        In burst mode the bytes go in a single stream """
+        sent = 0
+        n = 0
+        for chip, start, end, index in self._spans_at(page, column, len(data)):
+            if self._e_mask:
+                n, commands = self._render_span(data, index - start, start, end, chip, page, n)
+            else:
+                commands = self._write_span(data, index - start, start, end, chip, page)
+            sent += commands + end - start
+            self._shadow_at(data, index, start, end, chip, page)
+        if n:
+            self._ioext.stream_gpio(self._burst_view[:n])
+            self._txdata = self._burst[n - 1]
+        return sent
 
-    def print_buffer(self, buffer):
-        start = time.ticks_us()
-        self._write_command_ticks = 0
-        self._write_data_ticks = 0
-        self._write_data_count = 0
-        #self._spi_ticks = 0
-        #self._set_data_value_ticks = 0
-        self._ioext.clear_spi_ticks()
-        self._write_framebuffer(buffer)
-        print('Spent {}us in write_data ({}) and {}us in write_command for a total time of {}us'.format(self._write_data_ticks, self._write_data_count, self._write_command_ticks, time.ticks_us() - start))
-        self._ioext.print_spi_ticks()
-        #print('set_data_value {}'.format(self._set_data_value_ticks))
-        #print('spi ticks {}'.format(self._spi_ticks))
+    def set_start_line(self, line):
+        """ Shows the display RAM from line on the top row (hardware vertical scrolling) """
+        self._start_line = line % self._height
+        for chip in range(self._chips):
+            self._write_command(LCD_DISPLAY_START | self._start_line, chip)
 
     def _write_command(self, cmd, chip):
-        start = time.ticks_us()
-        self._set_cs(chip)
-        self._set_txdata_bit(self._rs, 0)
-        self._set_txdata_bit(self._rw, 0)
-
-        self._set_data_value(cmd)
+        self._txdata = self._data_words[cmd] | self._command_words[chip]
         self._ioext.write_gpio(self._txdata)
         self._en()
-        self._write_command_ticks += time.ticks_diff(time.ticks_us(), start)
 
     def _write_data(self, data, chip):
-        start = time.ticks_us()
-        self._write_data_count += 1
-        self._set_cs(chip)
-        self._set_txdata_bit(self._rs, 1)
-        self._set_txdata_bit(self._rw, 0)
-
-        self._set_data_value(data)
+        self._txdata = self._data_words[data] | self._data_ctrl_words[chip]
         self._ioext.write_gpio(self._txdata)
         self._en()
-        self._write_data_ticks += time.ticks_diff(time.ticks_us(), start)
-
-
-    def _set_cs(self, chip):
-        for i in range(self._chips):
-            if i == chip:
-                self._set_txdata_bit(self._cs[i], 1)
-            else:
-                self._set_txdata_bit(self._cs[i], 0)
-
-    def _set_data_value(self, value):
-        #start = time.ticks_us()
-        for i in range(8):
-            self._set_txdata_bit(self._data[i], (value >> i) & 1)
-        #self._set_data_value_ticks += time.ticks_us() - start
 
     def _en(self):
+        if self._e_mask:
+            # The word without e has just been written, it provides the setup time
+            self._ioext.write_gpio(self._txdata | self._e_mask)
+            self._ioext.write_gpio(self._txdata)
+            return
         time.sleep_us(1)
         self._e.high()
         time.sleep_us(1)
         self._e.low()
 
-    def _write_framebuffer(self, buffer):
+    def _flush(self, buffer):
+        """ Sends the parts of buffer that changed since the last call """
         # page = 8, chip = 2, pixel width = 64 : 8*2*64 = 1024
         # 1024 _write_data + 32 _write_command = (1024+32)*2us = 2112us
         #print('page {} chips {}'.format(self._pages, self._chips))
+        sent = 0
+        commands = 0
+        bursts = 0
+        full = self._shadow == None
+        if full:
+            self._shadow = bytearray(len(buffer))
         for page in range(self._pages):
+            if self._e_mask:
+                count, page_commands = self._write_page_burst(buffer, page, full)
+                sent += count
+                commands += page_commands
+                if count:
+                    bursts += 1
+                continue
             for chip in range(self._chips):
-                self._write_command(0xb8 | (0x07 & page), chip)
-                self._write_command(0x40, chip)
-                self._write_page(buffer, page, chip)
-    
-    def _write_page(self, buffer, page, chip):
-        for i in range(64):
-            self._write_data(buffer[i + (64 * chip) + (page * self._width)], chip)
+                offset = (64 * chip) + (page * self._width)
+                spans = ((0, 64),) if full else changed_spans(buffer, self._shadow, offset)
+                for start, end in spans:
+                    count = self._write_span(buffer, offset, start, end, chip, page)
+                    sent += count + end - start
+                    commands += count
+        self._shadow[:] = buffer
+        self._commands = commands
+        # One gpio write per byte, or the IOCON writes around each page stream in burst mode.
+        # Writes skipped by the expander register cache are counted
+        self._transactions = 3 * bursts if self._e_mask else sent
+        return sent
+
+    def _write_span(self, buffer, offset, start, end, chip, page):
+        # Addresses the chip if needed then writes the bytes, returns the commands sent
+        address = self._address(chip, page, start, end)
+        if address & SET_PAGE:
+            self._write_command(0xb8 | (0x07 & page), chip)
+        if address & SET_COLUMN:
+            self._write_command(0x40 | start, chip)
+        self._write_page(buffer, offset, start, end, chip)
+        return COMMANDS[address]
+
+    def _write_page_burst(self, buffer, page, full):
+        n = 0
+        sent = 0
+        commands = 0
+        for chip in range(self._chips):
+            offset = (64 * chip) + (page * self._width)
+            spans = ((0, 64),) if full else changed_spans(buffer, self._shadow, offset)
+            for start, end in spans:
+                n, count = self._render_span(buffer, offset, start, end, chip, page, n)
+                sent += count + end - start
+                commands += count
+        if n:
+            self._ioext.stream_gpio(self._burst_view[:n])
+            self._txdata = self._burst[n - 1]
+        return sent, commands
+
+    def _render_span(self, buffer, offset, start, end, chip, page, n):
+        # Renders the bus cycles of a span from self._burst[n], returns the next position
+        # and the commands rendered
+        words = self._burst
+        data_words = self._data_words
+        e = self._e_mask
+        address = self._address(chip, page, start, end)
+        # Commands: a setup word for cs/rs, then one e pulse per command
+        ctrl = self._command_words[chip]
+        if address & SET_PAGE:
+            word = data_words[0xb8 | (0x07 & page)] | ctrl
+            words[n] = word
+            words[n + 1] = word | e
+            words[n + 2] = word
+            n += 3
+        if address & SET_COLUMN:
+            word = data_words[0x40 | start] | ctrl
+            if not address & SET_PAGE:
+                words[n] = word
+                n += 1
+            words[n] = word | e
+            words[n + 1] = word
+            n += 2
+        # Data: rs goes high with the first byte before its e pulse
+        ctrl = self._data_ctrl_words[chip]
+        words[n] = data_words[buffer[offset + start]] | ctrl
+        n += 1
+        for i in range(offset + start, offset + end):
+            word = data_words[buffer[i]] | ctrl
+            words[n] = word | e
+            words[n + 1] = word
+            n += 2
+        return n, COMMANDS[address]
+
+    def _write_page(self, buffer, offset, start, end, chip):
+        for i in range(offset + start, offset + end):
+            self._write_data(buffer[i], chip)
@@ -29,8 +29,11 @@
 
 __version__ = '0.0.2'
 
-from time import sleep_us, ticks_us
+from time import sleep_us, ticks_us, ticks_diff
 from machine import Pin
+from array import array
+from histogram import log2_bucket
+import micropython
 
 """Register addresses as documented in the technical data sheet at
 http://ww1.microchip.com/downloads/en/DeviceDoc/21952b.pdf
@@ -57,6 +60,21 @@ MCP23S17_GPIOB = 0x13
 MCP23S17_OLATA = 0x14
 MCP23S17_OLATB = 0x15
 
+"""Register addresses of the 8 bits variants (MCP23S08/MCP23008) as documented at
+http://ww1.microchip.com/downloads/en/DeviceDoc/21919e.pdf
+"""
+MCP23S08_IODIR = 0x00
+MCP23S08_IPOL = 0x01
+MCP23S08_GPINTEN = 0x02
+MCP23S08_DEFVAL = 0x03
+MCP23S08_INTCON = 0x04
+MCP23S08_IOCON = 0x05
+MCP23S08_GPPU = 0x06
+MCP23S08_INTF = 0x07
+MCP23S08_INTCAP = 0x08
+MCP23S08_GPIO = 0x09
+MCP23S08_OLAT = 0x0A
+
 """Bit field flags as documentined in the technical data sheet at
 http://ww1.microchip.com/downloads/en/DeviceDoc/21952b.pdf
 """
@@ -72,6 +90,9 @@ IOCON_BANK_MODE = 0x80
 MCP23S17_CMD_WRITE = 0x40
 MCP23S17_CMD_READ = 0x41
 
+# I2C address of the MCP230xx, ORed with the hardware address
+MCP23017_ADDRESS = 0x20
+
 # Setup flags
 INPUT_POL_OPP=0x1
 INPUT_POL_SAME=0x2
@@ -84,29 +105,264 @@ IOC_CMP_PREV=0x80
 INPUT_PULLUP=0x100
 INPUT_NO_PULLUP=0x200
 
-class _InterruptSubscription():
-    def __init__(self, pin, callback):
-        self._pin = pin
-        self._callback = callback
+# Unchanged registers between two dirty ones are rewritten from the latch
+# cache rather than opening a new transfer when the gap is this small.
+_MERGE_GAP = 2
+
+# Longest sequential transfer: every register of the MCP23x17
+_MAX_BURST = MCP23S17_OLATB + 1
+
+class _Batch():
+    def __init__(self, mcp):
+        self._mcp = mcp
+
+    def __enter__(self):
+        self._mcp.begin_batch()
+        return self._mcp
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._mcp.commit()
+
+class EdgeLog():
+    """ Ring of (ticks_us, INTF, INTCAP) interrupt records with dispatch timing histograms.
+    Nothing is allocated while recording. """
+
+    # Latency and handler time histograms, see log2_bucket()
+    BUCKETS = 16
+
+    def __init__(self, size=64):
+        self._ticks = array('I', [0] * size)
+        self._flags = array('H', [0] * size)
+        self._captured = array('H', [0] * size)
+        self._head = 0
+        self._count = 0
+        self._irq_ticks = 0
+        self.overflows = 0
+        # IRQ to dispatch latency and time spent in the handlers
+        self.latency = array('I', [0] * EdgeLog.BUCKETS)
+        self.handler_time = array('I', [0] * EdgeLog.BUCKETS)
+        self.latency_max = 0
+        self.handler_time_max = 0
+
+    def _record(self, flags, captured, start, end):
+        latency = ticks_diff(start, self._irq_ticks)
+        duration = ticks_diff(end, start)
+        self.latency[log2_bucket(latency, EdgeLog.BUCKETS)] += 1
+        self.handler_time[log2_bucket(duration, EdgeLog.BUCKETS)] += 1
+        if latency > self.latency_max:
+            self.latency_max = latency
+        if duration > self.handler_time_max:
+            self.handler_time_max = duration
+
+        size = len(self._ticks)
+        if self._count == size:
+            self.overflows += 1
+            return
+        index = (self._head + self._count) % size
+        self._ticks[index] = self._irq_ticks
+        self._flags[index] = flags
+        self._captured[index] = captured
+        self._count += 1
+
+    def pop(self):
+        """ Returns the oldest (ticks_us, INTF, INTCAP) record or None """
+        if not self._count:
+            return None
+        index = self._head
+        self._head = (index + 1) % len(self._ticks)
+        self._count -= 1
+        return (self._ticks[index], self._flags[index], self._captured[index])
+
+    def drain(self):
+        """ Yields and removes every record, oldest first """
+        while self._count:
+            yield self.pop()
+
+    def reset_stats(self):
+        for i in range(EdgeLog.BUCKETS):
+            self.latency[i] = 0
+            self.handler_time[i] = 0
+        self.latency_max = 0
+        self.handler_time_max = 0
+        self.overflows = 0
+
+class SpiTransport():
+    """ SPI framing of the MCP23Sxx: opcode with the hardware address, register, then data """
+
+    def __init__(self, spi, pin_cs, device_id=0x00):
+        """ spi : initialized SPI bus (mode 0).
+        pin_cs : The Chip Select pin of the MCP.
+        device_id : The device ID of the component, i.e., the hardware address (default 0)
+        """
+        self._spi = spi
+        self._pin_cs = pin_cs
+        self._write_cmd = MCP23S17_CMD_WRITE | (device_id << 1) # prepare addr for payloads
+        self._read_cmd = MCP23S17_CMD_READ | (device_id << 1)
+        # Preallocated buffers with one view per transfer length, so that no transfer allocates
+        self._txbuf = bytearray(_MAX_BURST + 2)
+        self._rxbuf = bytearray(_MAX_BURST + 2)
+        tx = memoryview(self._txbuf)
+        rx = memoryview(self._rxbuf)
+        self._tx = [tx[:n] for n in range(_MAX_BURST + 3)]
+        self._rx = [rx[:n] for n in range(_MAX_BURST + 3)]
+        self._data = [rx[2:n + 2] for n in range(_MAX_BURST + 1)]
+        # Non zero during a transfer, the scheduled callbacks must not use the bus then
+        self.busy = 0
+
+    def write_register(self, register, value):
+        self.busy += 1
+        try:
+            tx = self._txbuf
+            tx[0] = self._write_cmd
+            tx[1] = register
+            tx[2] = value
+            self._pin_cs.value( 0 )
+            self._spi.write( self._tx[3] )
+            self._pin_cs.value( 1 )
+        finally:
+            self.busy -= 1
+
+    def write_registers(self, register, data):
+        self.busy += 1
+        try:
+            count = len(data)
+            tx = self._txbuf
+            tx[0] = self._write_cmd
+            tx[1] = register
+            for i in range(count):
+                tx[i + 2] = data[i]
+            self._pin_cs.value( 0 )
+            self._spi.write( self._tx[count + 2] )
+            self._pin_cs.value( 1 )
+        finally:
+            self.busy -= 1
+
+    def write_stream(self, register, data):
+        """ Writes data from register in one transfer, without copying it """
+        self.busy += 1
+        try:
+            tx = self._txbuf
+            tx[0] = self._write_cmd
+            tx[1] = register
+            self._pin_cs.value( 0 )
+            self._spi.write( self._tx[2] )
+            self._spi.write( data )
+            self._pin_cs.value( 1 )
+        finally:
+            self.busy -= 1
+
+    def read_register(self, register):
+        return self.read_registers(register, 1)[0]
+
+    def read_registers(self, register, count):
+        """ Returns a view of count bytes, valid until the next transfer """
+        self.busy += 1
+        try:
+            tx = self._txbuf
+            tx[0] = self._read_cmd
+            tx[1] = register
+            self._pin_cs.value( 0 )
+            # The data bytes are clocked in while the bytes following the header are sent
+            self._spi.write_readinto( self._tx[count + 2], self._rx[count + 2] )
+            self._pin_cs.value( 1 )
+        finally:
+            self.busy -= 1
+        return self._data[count]
 
-    def _isAffected(self, interrupted_pins):
-        return self._pin in interrupted_pins
+class I2cTransport():
+    """ I2C framing of the MCP230xx: register accesses are memory accesses """
 
-    def __call__(self, values):
-        if self._isAffected(values):
-            self._callback(values[self._pin])
+    def __init__(self, i2c, address):
+        """ i2c : initialized I2C bus.
+        address : The 7 bits I2C address of the MCP
+        """
+        self._i2c = i2c
+        self._address = address
+        self._buf = bytearray(_MAX_BURST)
+        buf = memoryview(self._buf)
+        self._views = [buf[:n] for n in range(_MAX_BURST + 1)]
+        # Non zero during a transfer, the scheduled callbacks must not use the bus then
+        self.busy = 0
+
+    def write_register(self, register, value):
+        self.busy += 1
+        try:
+            self._buf[0] = value
+            self._i2c.writeto_mem(self._address, register, self._views[1])
+        finally:
+            self.busy -= 1
+
+    def write_registers(self, register, data):
+        self.busy += 1
+        try:
+            self._i2c.writeto_mem(self._address, register, data)
+        finally:
+            self.busy -= 1
+
+    def write_stream(self, register, data):
+        """ Writes data from register in one transfer, without copying it """
+        self.busy += 1
+        try:
+            self._i2c.writeto_mem(self._address, register, data)
+        finally:
+            self.busy -= 1
+
+    def read_register(self, register):
+        return self.read_registers(register, 1)[0]
+
+    def read_registers(self, register, count):
+        """ Returns a view of count bytes, valid until the next transfer """
+        view = self._views[count]
+        self.busy += 1
+        try:
+            self._i2c.readfrom_mem_into(self._address, register, view)
+        finally:
+            self.busy -= 1
+        return view
+
+class Deferred():
+    """ Runs callback() from micropython.schedule() on behalf of an interrupt, never in the
+    middle of a transfer of the transport. schedule() allocates nothing and may be called
+    from a hard IRQ. """
+
+    def __init__(self, transport, callback):
+        self._transport = transport
+        self._callback = callback
+        self._run_ref = self._run # bound once, the hard IRQ must not allocate
+        # Scheduled and not run yet
+        self.pending = False
+        # Calls lost to a full schedule queue
+        self.dropped = 0
+
+    def schedule(self):
+        self.pending = True
+        try:
+            micropython.schedule(self._run_ref, 0)
+        except RuntimeError:
+            # Queue full: not left pending, or nothing would be scheduled any more
+            self.pending = False
+            self.dropped += 1
+
+    def _run(self, _):
+        if self._transport.busy:
+            # Scheduled in the middle of a transfer of the main code, run again after it
+            self.schedule()
+            return
+        self.pending = False
+        self._callback()
 
-class MCP23S17(object):
-    """ This class provides an abstraction of the GPIO expander MCP23S17 """
+class MCP23x17(object):
+    """ This class provides an abstraction of the GPIO expanders MCP23S17/MCP23017,
+    independent of the bus used to reach them """
 
-    def __init__(self, spi, pin_cs, mode=IOCON_HAEN, pin_int=None, device_id=0x00):
-        """ spi : initialized SPI bus (mode 0).
-        pin_cs : The Chip Select pin of the MCP.
+    _PINS = 16
+
+    def __init__(self, transport, mode=IOCON_HAEN, pin_int=None):
+        """ transport : SpiTransport or I2cTransport of the MCP.
         mode : The global flags
         pin_int : interrupt pin
-        device_id : The device ID of the component, i.e., the hardware address (default 0)
         """
-        self._device_id = device_id << 1 # prepare addr for payloads
+        self._transport = transport
         self._mode = mode
         self._GPIOA = 0
         self._GPIOB = 0
@@ -122,25 +378,37 @@ class MCP23S17(object):
         self._DEFVALB = 0
         self._INTCONA = 0
         self._INTCONB = 0
+        # Values last sent to the chip, used to skip writes that change nothing
+        self._latched = bytearray(MCP23S17_OLATB + 1)
+        self._latched_valid = 0
+        # Values waiting for commit() while batching
+        self._pending = bytearray(MCP23S17_OLATB + 1)
+        self._dirty = 0
+        self._batch_depth = 0
+        self._batch = _Batch(self)
+        self._pending_view = memoryview(self._pending)
+        self._word = bytearray(2)
+        # Last interrupt flags and captured port values, INTFB/INTCAPB in the high byte
+        self._INTF = 0
+        self._INTCAP = 0
+        # One handler slot per pin
+        self._interrupt_handlers = [None] * 16
+        self._deferred = Deferred(transport, self._dispatch)
+        self._edge_log = None
         self._pin_reset = -1 # removed from parameters
-        #self._bus = bus
-        self._pin_cs = pin_cs
         self._pin_int = pin_int
-        #self._spimode = 0b00
-        self._spi = spi
         if self._pin_int != None:
-            self._pin_int.irq(self._irqHandler, Pin.IRQ_FALLING)
-            self._interrupt_handlers = []
+            self._pin_int.irq(self._irqHandler, Pin.IRQ_FALLING, hard=True)
         self.begin()
 
     def begin(self):
         #Initializes the MCP23S17 with hardware-address access and sequential operations mode.
+        # Nothing is known about the chip state yet, write everything.
+        self._latched_valid = 0
         self._writeRegister( MCP23S17_IOCON, self._mode)
 
         # set defaults
-        for index in range(0, 16): # 0 to 15
-            self.setup(index, Pin.IN)
-            self.pullup(index, True)
+        self.setup_pins({index: (Pin.IN, INPUT_POL_SAME|IOC_DISABLED|INPUT_PULLUP) for index in range(0, 16)})
 
     def setup(self, pin, mode, flags=INPUT_POL_SAME|IOC_DISABLED):
         """ Sets the direction for a given pin. """
@@ -148,10 +416,17 @@ class MCP23S17(object):
         #  pin -- The pin index (0 - 15)
         #  mode -- The direction of the pin (Pin.In, Pin.OUT)
         #  flags -- ORed list of flags
+        self.setup_pins({pin: (mode, flags)})
 
-        self._validate_pin(pin)
-        assert ((mode == Pin.IN) or (mode == Pin.OUT))
-        
+    def setup_pins(self, pins):
+        """ Sets the direction and flags of multiple pins at once. Pins = dict of pin:(mode, flags) """
+        [self._validate_pin(pin) for pin in pins.keys()]
+        for pin, (mode, flags) in iter(pins.items()):
+            assert ((mode == Pin.IN) or (mode == Pin.OUT))
+            self._updatePinConfig(pin, mode, flags)
+        self._writeConfig()
+
+    def _updatePinConfig(self, pin, mode, flags):
         if (pin < 8):
             self._IODIRA = self._updateRegisterData(self._IODIRA, pin, mode == Pin.IN)
             self._IPOLA = self._updateRegisterData(self._IPOLA, pin, flags & INPUT_POL_OPP)
@@ -159,13 +434,6 @@ class MCP23S17(object):
             self._DEFVALA = self._updateRegisterData(self._DEFVALA, pin, flags & IOC_DEF_1)
             self._INTCONA = self._updateRegisterData(self._INTCONA, pin, flags & IOC_CMP_DEF)
             self._GPPUA = self._updateRegisterData(self._GPPUA, pin, flags & INPUT_PULLUP)
-
-            self._writeRegister(MCP23S17_IODIRA, self._IODIRA)
-            self._writeRegister(MCP23S17_IPOLA, self._IPOLA)
-            self._writeRegister(MCP23S17_GPINTENA, self._GPINTENA)
-            self._writeRegister(MCP23S17_DEFVALA, self._DEFVALA)
-            self._writeRegister(MCP23S17_INTCONA, self._INTCONA)
-            self._writeRegister(MCP23S17_GPPUA, self._GPPUA)
         else:
             self._IODIRB = self._updateRegisterData(self._IODIRB, pin, mode == Pin.IN)
             self._IPOLB = self._updateRegisterData(self._IPOLB, pin, flags & INPUT_POL_OPP)
@@ -174,12 +442,33 @@ class MCP23S17(object):
             self._INTCONB = self._updateRegisterData(self._INTCONB, pin, flags & IOC_CMP_DEF)
             self._GPPUB = self._updateRegisterData(self._GPPUB, pin, flags & INPUT_PULLUP)
 
-            self._writeRegister(MCP23S17_IODIRB, self._IODIRB)
-            self._writeRegister(MCP23S17_IPOLB, self._IPOLB)
-            self._writeRegister(MCP23S17_GPINTENB, self._GPINTENB)
-            self._writeRegister(MCP23S17_DEFVALB, self._DEFVALB)
-            self._writeRegister(MCP23S17_INTCONB, self._INTCONB)
-            self._writeRegister(MCP23S17_GPPUB, self._GPPUB)
+    def _writeConfig(self):
+        # IODIRA..INTCONB (0x00 - 0x09) are contiguous, GPPUA/GPPUB (0x0C - 0x0D) follow IOCON.
+        # Only the registers that changed are sent, merged in as few bursts as possible.
+        with self._batch:
+            self._writeRegisters(MCP23S17_IODIRA, bytes([
+                self._IODIRA, self._IODIRB,
+                self._IPOLA, self._IPOLB,
+                self._GPINTENA, self._GPINTENB,
+                self._DEFVALA, self._DEFVALB,
+                self._INTCONA, self._INTCONB]))
+            self._writeRegisterWord(MCP23S17_GPPUA, (self._GPPUB << 8) | self._GPPUA)
+
+    def batch(self):
+        """ Context manager deferring register writes until the end of the block. """
+        return self._batch
+
+    def begin_batch(self):
+        """ Defers register writes until commit(). Calls can be nested. """
+        self._batch_depth += 1
+
+    def commit(self):
+        """ Ends a batch and writes the registers that changed. """
+        if self._batch_depth > 1:
+            self._batch_depth -= 1
+            return
+        self._batch_depth = 0
+        self._flush()
 
     def _updateRegisterData(self, data, pin, val):
         pin_mask = self._pinMask(pin)
@@ -190,18 +479,63 @@ class MCP23S17(object):
         return data
 
     def registerInterruptHandler(self, pin, callback):
-        self._interrupt_handlers.append(_InterruptSubscription(pin, callback))
+        """ Calls callback(level) when pin raises an interrupt. One handler per pin. """
+        self._validate_pin(pin)
+        self._interrupt_handlers[pin] = callback
+
+    def unregisterInterruptHandler(self, pin):
+        self._validate_pin(pin)
+        self._interrupt_handlers[pin] = None
 
     def _irqHandler(self, pin):
-        prev_values = self._GPIOB << 8 | self._GPIOA
-        new_values = self.read_gpio()
-        interrupted_pins = {}
-        for i in range(0, 16):
-            new_value = (new_values >> i) & 0x1
-            if (prev_values >> i) & 0x1 != new_value:
-                interrupted_pins[i] = new_value
-        for sub in self._interrupt_handlers:
-            sub(interrupted_pins)
+        # Hard IRQ context: no bus access and no allocation, defer the work
+        if not self._deferred.pending:
+            if self._edge_log != None:
+                self._edge_log._irq_ticks = ticks_us()
+            self._deferred.schedule()
+
+    def _dispatch(self):
+        start = ticks_us()
+        flags = self._readInterrupts()
+        captured = self._INTCAP
+        handlers = self._interrupt_handlers
+        pin = 0
+        pending = flags
+        while pending:
+            if pending & 0x1:
+                handler = handlers[pin]
+                if handler != None:
+                    handler((captured >> pin) & 0x1)
+            pending >>= 1
+            pin += 1
+        if self._edge_log != None:
+            self._edge_log._record(flags, captured, start, ticks_us())
+
+    def enable_edge_log(self, size=64):
+        """ Starts recording every interrupt in an EdgeLog of size records, returns it """
+        self._edge_log = EdgeLog(size)
+        return self._edge_log
+
+    def disable_edge_log(self):
+        self._edge_log = None
+
+    def _readInterrupts(self):
+        """ Reads INTF and INTCAP, which also clears the interrupt. Returns the 16 bits INTF """
+        if self._sequentialOpEnabled():
+            data = self._transport.read_registers(MCP23S17_INTFA, 4)
+            flags = data[1] << 8 | data[0]
+            captured = data[3] << 8 | data[2]
+        else:
+            flags = self._readRegisterWord(MCP23S17_INTFA)
+            captured = self._readRegisterWord(MCP23S17_INTCAPA)
+        self._INTF = flags
+        self._INTCAP = captured
+        # INTCAP holds the port state when the interrupt fired, only valid for the ports that fired
+        if flags & 0xFF:
+            self._GPIOA = captured & 0xFF
+        if flags >> 8:
+            self._GPIOB = captured >> 8
+        return flags
 
     def input(self, pin):
         """ Reads the logical level of a given pin. """
@@ -318,61 +652,351 @@ class MCP23S17(object):
         self._GPIOB = (data >> 8)
         self._writeRegisterWord(MCP23S17_GPIOA, data)
 
-    def read_gpio(self):
-        """ Reads the data port value of all pins. Store the values internally then returns a 16 bits data """
+    def stream_gpio(self, words):
+        """ Writes a sequence of 16 bits port values in a single transfer, e.g. an array('H').
+        Sequential operation is disabled during the transfer so that the address pointer
+        toggles between GPIOA and GPIOB. Not deferred by batch(). """
+        count = len(words)
+        if not count:
+            return
+        sequential = self._sequentialOpEnabled()
+        transport = self._transport
+        # Busy until IOCON is restored, a scheduled read would see the pointer toggling
+        transport.busy += 1
+        try:
+            if sequential:
+                transport.write_register(MCP23S17_IOCON, self._mode | IOCON_SEQOP)
+            transport.write_stream(MCP23S17_GPIOA, words)
+            if sequential:
+                transport.write_register(MCP23S17_IOCON, self._mode)
+        finally:
+            transport.busy -= 1
+        if sequential:
+            self._latched[MCP23S17_IOCON] = self._mode
+            self._latched_valid |= 1 << MCP23S17_IOCON
+        data = words[count - 1]
+        self._GPIOA = data & 0xFF
+        self._GPIOB = data >> 8
+        self._latched[MCP23S17_GPIOA] = self._GPIOA
+        self._latched[MCP23S17_GPIOB] = self._GPIOB
+        self._latched_valid |= 3 << MCP23S17_GPIOA
+
+    def read_gpio(self, read=True):
+        """ Reads the data port value of all pins. Store the values internally then returns a 16 bits data.
+        Read False returns the stored values without accessing the bus """
+        if not read:
+            return (self._GPIOB << 8) | self._GPIOA
         data = self._readRegisterWord(MCP23S17_GPIOA)
         self._GPIOA = (data & 0xFF)
         self._GPIOB = (data >> 8)
         return data
 
     def _writeRegister(self, register, value):
-        command = MCP23S17_CMD_WRITE | self._device_id
-        self._pin_cs.value( 0 )
-        #sleep_us( 1 )
-        self._spi.write( bytes([command, register, value]) )
-        self._pin_cs.value( 1 )
-        #sleep_us( 1 )
+        if self._batch_depth:
+            self._stageRegister(register, value)
+            return
+        bit = 1 << register
+        if (self._latched_valid & bit) and self._latched[register] == value:
+            return
+        self._transport.write_register(register, value)
+        self._latched[register] = value
+        self._latched_valid |= bit
 
     def _readRegister(self, register):
-        command = MCP23S17_CMD_READ | self._device_id
-        self._pin_cs.value( 0 )
-        #sleep_us( 1 )
-        #self._setSpiMode(self._spimode)
-        self._spi.write( bytes([command, register]) )
-        #data = self._spi.xfer2([command, register, 0])
-        data = self._spi.read( 1 )
-        self._pin_cs.value( 1 )
-        #sleep_us( 1 )
-        return data[0]# data[2]
+        return self._transport.read_register(register)
 
     def _readRegisterWord(self, register):
         if self._sequentialOpEnabled():
-            command = MCP23S17_CMD_READ | self._device_id
-            self._pin_cs.value( 0 )
-            self._spi.write( bytes([command, register]) )
-            data = self._spi.read( 2 )
-            self._pin_cs.value( 1 )
+            data = self._transport.read_registers(register, 2)
             return data[1] << 8 | data[0]
-        buffer = [0, 0]
-        buffer[0] = self._readRegister(register)
-        buffer[1] = self._readRegister(register + 1)
-        return ((buffer[1] << 8) | buffer[0])
+        low = self._readRegister(register)
+        return (self._readRegister(register + 1) << 8) | low
 
     def _writeRegisterWord(self, register, data):
+        if self._batch_depth:
+            self._stageRegister(register, data & 0xFF)
+            self._stageRegister(register + 1, data >> 8)
+            return
+        bits = 3 << register
+        if (self._latched_valid & bits) == bits:
+            if self._latched[register + 1] == data >> 8:
+                self._writeRegister(register, data & 0xFF)
+                return
+            if self._latched[register] == data & 0xFF:
+                self._writeRegister(register + 1, data >> 8)
+                return
         if self._sequentialOpEnabled():
-            command = MCP23S17_CMD_WRITE | self._device_id
-            self._pin_cs.value( 0 )
-            self._spi.write( bytes([command, register, data & 0xFF, data >> 8]) )
-            self._pin_cs.value( 1 )
+            word = self._word
+            word[0] = data & 0xFF
+            word[1] = data >> 8
+            self._transport.write_registers(register, word)
+            self._latched[register] = data & 0xFF
+            self._latched[register + 1] = data >> 8
+            self._latched_valid |= bits
             return
         self._writeRegister(register, data & 0xFF)
         self._writeRegister(register + 1, data >> 8)
 
+    def _writeRegisters(self, register, data):
+        self.begin_batch()
+        for value in data:
+            self._stageRegister(register, value)
+            register += 1
+        self.commit()
+
+    def _stageRegister(self, register, value):
+        self._pending[register] = value
+        self._dirty |= 1 << register
+
+    def _flush(self):
+        dirty = self._dirty
+        self._dirty = 0
+        # Drop the writes that would not change anything
+        for register in range(MCP23S17_OLATB + 1):
+            bit = 1 << register
+            if (dirty & bit) and (self._latched_valid & bit) and self._pending[register] == self._latched[register]:
+                dirty &= ~bit
+
+        start = -1
+        end = -1
+        for register in range(MCP23S17_OLATB + 1):
+            if not (dirty & (1 << register)):
+                continue
+            if start >= 0 and self._canMerge(end + 1, register):
+                end = register
+                continue
+            if start >= 0:
+                self._writeRun(start, end)
+            start = register
+            end = register
+        if start >= 0:
+            self._writeRun(start, end)
+
+    def _canMerge(self, first, last):
+        # Registers in [first, last) are rewritten with their latched value
+        if not self._sequentialOpEnabled() or last - first > _MERGE_GAP:
+            return False
+        for register in range(first, last):
+            if not (self._latched_valid & (1 << register)):
+                return False
+        for register in range(first, last):
+            self._pending[register] = self._latched[register]
+        return True
+
+    def _writeRun(self, start, end):
+        if self._sequentialOpEnabled():
+            self._transport.write_registers(start, self._pending_view[start:end + 1])
+        else:
+            for register in range(start, end + 1):
+                self._transport.write_register(register, self._pending[register])
+        for register in range(start, end + 1):
+            self._latched[register] = self._pending[register]
+            self._latched_valid |= 1 << register
+
     def _sequentialOpEnabled(self):
         # SEQOP = 1 means sequential operation disabled
         return not (self._mode & IOCON_SEQOP)
 
     def _validate_pin(self, pin):
         # Raise an exception if pin is outside the range of allowed values.
-        if pin < 0 or pin >= 16:
-            raise ValueError('Invalid GPIO value, must be between 0 and 15.')
+        if pin < 0 or pin >= self._PINS:
+            raise ValueError('Invalid GPIO value, must be between 0 and {}.'.format(self._PINS - 1))
+
+class MCP23S17(MCP23x17):
+    """ MCP23S17 on a SPI bus """
+
+    def __init__(self, spi, pin_cs, mode=IOCON_HAEN, pin_int=None, device_id=0x00):
+        """ spi : initialized SPI bus (mode 0).
+        pin_cs : The Chip Select pin of the MCP.
+        mode : The global flags
+        pin_int : interrupt pin
+        device_id : The device ID of the component, i.e., the hardware address (default 0)
+        """
+        super().__init__(SpiTransport(spi, pin_cs, device_id), mode, pin_int)
+
+class MCP23017(MCP23x17):
+    """ MCP23017 on an I2C bus """
+
+    def __init__(self, i2c, mode=0, pin_int=None, device_id=0x00):
+        """ i2c : initialized I2C bus.
+        mode : The global flags
+        pin_int : interrupt pin
+        device_id : The device ID of the component, i.e., the hardware address (default 0)
+        """
+        super().__init__(I2cTransport(i2c, MCP23017_ADDRESS | device_id), mode, pin_int)
+
+class MCP23x08(MCP23x17):
+    """ 8 bits members of the family (MCP23S08/MCP23008): a single port, handled as port A """
+
+    _PINS = 8
+
+    def begin(self):
+        # Nothing is known about the chip state yet, write everything.
+        self._latched_valid = 0
+        self._writeRegister( MCP23S08_IOCON, self._mode)
+
+        # set defaults
+        self.setup_pins({index: (Pin.IN, INPUT_POL_SAME|IOC_DISABLED|INPUT_PULLUP) for index in range(0, 8)})
+
+    def _writeConfig(self):
+        # IODIR..INTCON (0x00 - 0x04) are contiguous, GPPU (0x06) follows IOCON.
+        with self._batch:
+            self._writeRegisters(MCP23S08_IODIR, bytes([
+                self._IODIRA, self._IPOLA, self._GPINTENA, self._DEFVALA, self._INTCONA]))
+            self._writeRegister(MCP23S08_GPPU, self._GPPUA)
+
+    def _readInterrupts(self):
+        """ Reads INTF and INTCAP, which also clears the interrupt. Returns INTF """
+        if self._sequentialOpEnabled():
+            data = self._transport.read_registers(MCP23S08_INTF, 2)
+            flags = data[0]
+            captured = data[1]
+        else:
+            flags = self._readRegister(MCP23S08_INTF)
+            captured = self._readRegister(MCP23S08_INTCAP)
+        self._INTF = flags
+        self._INTCAP = captured
+        if flags:
+            self._GPIOA = captured
+        return flags
+
+    def input(self, pin):
+        """ Reads the logical level of a given pin. """
+        self._validate_pin(pin)
+        self._GPIOA = self._readRegister(MCP23S08_GPIO)
+        return (self._GPIOA & (1 << pin)) != 0
+
+    def pullup(self, pin, enabled):
+        """ Enables or disables the pull-up mode for input pins. """
+        self._validate_pin( pin )
+        self._GPPUA = self._updateRegisterData(self._GPPUA, pin, enabled)
+        self._writeRegister(MCP23S08_GPPU, self._GPPUA)
+
+    def output(self, pin, level):
+        """ Sets the level of a given pin. """
+        self._validate_pin( pin )
+        data = self._updateRegisterData(self._GPIOA, pin, level)
+        self._writeRegister(MCP23S08_GPIO, data)
+        self._GPIOA = data
+
+    def output_pins(self, pins):
+        """Sets multiple pins high or low at once.  Pins = dict of pin:state """
+        [self._validate_pin(pin) for pin in pins.keys()]
+        data = self._GPIOA
+        for pin, value in iter(pins.items()):
+            data = self._updateRegisterData(data, pin, value)
+        self.write_gpio(data)
+
+    def write_gpio(self, data):
+        """ Sets the data port value for all pins with a 8 bit values AND send it to the MCP """
+        self._GPIOA = (data & 0xFF)
+        self._writeRegister(MCP23S08_GPIO, self._GPIOA)
+
+    def stream_gpio(self, data):
+        """ Writes a sequence of 8 bits port values in a single transfer, e.g. a bytearray.
+        Sequential operation is disabled during the transfer so that the address pointer
+        stays on GPIO. Not deferred by batch(). """
+        count = len(data)
+        if not count:
+            return
+        sequential = self._sequentialOpEnabled()
+        transport = self._transport
+        # Busy until IOCON is restored, a scheduled read would see the pointer toggling
+        transport.busy += 1
+        try:
+            if sequential:
+                transport.write_register(MCP23S08_IOCON, self._mode | IOCON_SEQOP)
+            transport.write_stream(MCP23S08_GPIO, data)
+            if sequential:
+                transport.write_register(MCP23S08_IOCON, self._mode)
+        finally:
+            transport.busy -= 1
+        if sequential:
+            self._latched[MCP23S08_IOCON] = self._mode
+            self._latched_valid |= 1 << MCP23S08_IOCON
+        self._GPIOA = data[count - 1]
+        self._latched[MCP23S08_GPIO] = self._GPIOA
+        self._latched_valid |= 1 << MCP23S08_GPIO
+
+    def read_gpio(self, read=True):
+        """ Reads the data port value of all pins. Store the values internally then returns a 8 bits data.
+        Read False returns the stored values without accessing the bus """
+        if not read:
+            return self._GPIOA
+        self._GPIOA = self._readRegister(MCP23S08_GPIO)
+        return self._GPIOA
+
+class MCP23S08(MCP23x08):
+    """ MCP23S08 on a SPI bus """
+
+    def __init__(self, spi, pin_cs, mode=IOCON_HAEN, pin_int=None, device_id=0x00):
+        """ spi : initialized SPI bus (mode 0).
+        pin_cs : The Chip Select pin of the MCP.
+        mode : The global flags
+        pin_int : interrupt pin
+        device_id : The device ID of the component, i.e., the hardware address (default 0)
+        """
+        super().__init__(SpiTransport(spi, pin_cs, device_id), mode, pin_int)
+
+class MCP23008(MCP23x08):
+    """ MCP23008 on an I2C bus """
+
+    def __init__(self, i2c, mode=0, pin_int=None, device_id=0x00):
+        """ i2c : initialized I2C bus.
+        mode : The global flags
+        pin_int : interrupt pin
+        device_id : The device ID of the component, i.e., the hardware address (default 0)
+        """
+        super().__init__(I2cTransport(i2c, MCP23017_ADDRESS | device_id), mode, pin_int)
+
+class MCP23S17Bank(object):
+    """ Up to eight hardware addressed MCP23S17 sharing one SPI bus and chip select,
+    exposed as a single GPIO space. Pin n of chip i is bit 16 * i + n. """
+
+    def __init__(self, spi, pin_cs, count=8, mode=IOCON_HAEN):
+        """ spi : initialized SPI bus (mode 0).
+        pin_cs : The Chip Select pin shared by the MCPs.
+        count : Number of chips, addressed from 0 to count - 1
+        mode : The global flags, must include IOCON_HAEN
+        """
+        if count < 1 or count > 8:
+            raise ValueError('Invalid chip count, must be between 1 and 8.')
+        if not (mode & IOCON_HAEN):
+            raise ValueError('Hardware addressing (IOCON_HAEN) is required.')
+        # Until HAEN is set every chip answers to address 0, so chip 0 is
+        # initialized first and enables hardware addressing on all of them.
+        self._chips = [MCP23S17(spi, pin_cs, mode, None, device_id) for device_id in range(count)]
+
+    def __len__(self):
+        return len(self._chips)
+
+    def __getitem__(self, index):
+        return self._chips[index]
+
+    def read_all(self):
+        """ Reads the data port of every chip, one word transfer each. Returns a 16 * count bits value """
+        data = 0
+        shift = 0
+        for chip in self._chips:
+            data |= chip.read_gpio() << shift
+            shift += 16
+        return data
+
+    def write_all(self, data):
+        """ Sets the data port of every chip from a 16 * count bits value """
+        for chip in self._chips:
+            chip.write_gpio(data & 0xFFFF)
+            data >>= 16
+
+    def write_bits(self, mask, data):
+        """ Sets the pins selected by mask to the matching bits of data. Chips with no
+        selected pin, or whose port would not change, are not accessed. """
+        for chip in self._chips:
+            chip_mask = mask & 0xFFFF
+            if chip_mask:
+                current = chip.read_gpio(False)
+                chip.write_gpio((current & ~chip_mask) | (data & chip_mask))
+            mask >>= 16
+            data >>= 16
+            if not mask:
+                break
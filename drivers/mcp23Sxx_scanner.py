@@ -0,0 +1,99 @@
+from machine import Timer
+from array import array
+from mcp23Sxx import Deferred
+import asyncio
+import time
+
+class MCP23S17Scanner():
+    """ Change detection for MCP23S17 boards without an INT line: both ports are polled
+    with one word read and every change is logged as (ticks_us, changed bits, port value). """
+
+    def __init__(self, ioext, mask=0xFFFF, size=64):
+        """ ioext : MCP23S17 to poll
+        mask : pins to watch, bit n for pin n
+        size : number of events kept until read with pop()
+        """
+        self._ioext = ioext
+        self._mask = mask
+        self._ticks = array('I', [0] * size)
+        self._changed = array('H', [0] * size)
+        self._values = array('H', [0] * size)
+        self._head = 0
+        self._count = 0
+        self._last = 0
+        self._timer = None
+        self._deferred = Deferred(ioext._transport, self.scan)
+        self._overlaps = 0
+        self.scans = 0
+        self.overruns = 0
+        self._start = time.ticks_us()
+
+    def start(self, freq=1000):
+        """ Polls from a machine.Timer at freq Hz """
+        self.stop()
+        self._reset()
+        self._timer = Timer(mode=Timer.PERIODIC, freq=freq, callback=self._timer_callback)
+
+    def stop(self):
+        if self._timer != None:
+            self._timer.deinit()
+            self._timer = None
+
+    async def run(self, period_ms=1):
+        """ Polls from an asyncio task every period_ms """
+        self._reset()
+        while True:
+            self.scan()
+            await asyncio.sleep_ms(period_ms)
+
+    @property
+    def missed(self):
+        """ Timer ticks without a scan: the previous one was still pending or the schedule
+        queue was full """
+        return self._overlaps + self._deferred.dropped
+
+    def _reset(self):
+        self._last = self._ioext.read_gpio()
+        self.scans = 0
+        self._start = time.ticks_us()
+
+    def _timer_callback(self, timer):
+        # May run as a hard IRQ: no bus access, defer the scan
+        if self._deferred.pending:
+            self._overlaps += 1
+            return
+        self._deferred.schedule()
+
+    def scan(self):
+        """ Reads both ports once and logs the watched pins that changed. Returns the changed bits """
+        value = self._ioext.read_gpio()
+        changed = (value ^ self._last) & self._mask
+        self._last = value
+        self.scans += 1
+        if changed:
+            size = len(self._ticks)
+            if self._count == size:
+                self.overruns += 1
+            else:
+                index = (self._head + self._count) % size
+                self._ticks[index] = time.ticks_us()
+                self._changed[index] = changed
+                self._values[index] = value
+                self._count += 1
+        return changed
+
+    def pop(self):
+        """ Returns the oldest (ticks_us, changed, value) event or None """
+        if not self._count:
+            return None
+        index = self._head
+        self._head = (index + 1) % len(self._ticks)
+        self._count -= 1
+        return (self._ticks[index], self._changed[index], self._values[index])
+
+    def scan_rate(self):
+        """ Scans per second achieved since the scanner was started """
+        elapsed = time.ticks_diff(time.ticks_us(), self._start)
+        if elapsed <= 0:
+            return 0
+        return self.scans * 1_000_000 / elapsed
@@ -0,0 +1,193 @@
+from display_drivers import AsyncDisplayDriver
+from bmp_display_driver import Bmp
+import mmap
+import struct
+import time
+
+# Capture file layout, little endian:
+#   header   : magic, version, header size, width, height, frame size, index capacity,
+#              frame count, stored frame count, end of the frame data
+#   index    : capacity entries of (timestamp ns, offset of the frame data)
+#   frames   : the stored frames, back to back
+# A frame identical to the previous one is only an index entry pointing to the same data.
+MAGIC = b'FREC'
+VERSION = 1
+HEADER = '<4sHHHHIIIIQ'
+HEADER_SIZE = 64
+ENTRY = '<QQ'
+ENTRY_SIZE = 16
+
+# The file grows by this many frames at a time
+GROW_FRAMES = 256
+
+class Recorder(AsyncDisplayDriver):
+    """ Appends every frame to a memory-mapped capture file, see Recording to read it back """
+
+    def __init__(self, filename, width, height, capacity=1 << 20) -> None:
+        """ capacity : maximum number of frames, the index is allocated for it (sparse file) """
+        self._filename = filename
+        self._width = width
+        self._height = height
+        self._frame_size = width * (height // 8)
+        self._capacity = capacity
+        self._data_start = HEADER_SIZE + capacity * ENTRY_SIZE
+
+        self._file = None
+        self._map = None
+        self._count = 0
+        self._stored = 0
+        self._data_end = self._data_start
+        self._last_offset = 0
+        # Copy of the last frame, None before the first one
+        self._shadow = None
+
+    async def init(self) -> None:
+        self._file = open(self._filename, 'w+b')
+        self._count = 0
+        self._stored = 0
+        self._data_end = self._data_start
+        self._shadow = None
+        self._remap(self._data_start + GROW_FRAMES * self._frame_size)
+        self._write_header()
+
+    async def _flush(self, buffer: bytearray) -> int:
+        """ Appends buffer to the capture. Returns the number of frame bytes stored """
+        sent = self._append(buffer)
+        # One index entry, and the frame unless it is a repeat
+        self._transactions = 2 if sent else 1
+        return sent
+
+    def invalidate(self):
+        """ Forces the next frame to be stored even if unchanged """
+        self._shadow = None
+
+    def close(self):
+        if self._map != None:
+            self._map.flush()
+            self._map.close()
+            self._map = None
+        if self._file != None:
+            self._file.truncate(self._data_end)
+            self._file.close()
+            self._file = None
+
+    def __len__(self):
+        return self._count
+
+    def _append(self, buffer):
+        if self._count == self._capacity:
+            raise OverflowError('capture index full ({} frames)'.format(self._capacity))
+        stored = 0
+        if self._shadow == None or self._shadow != buffer:
+            end = self._data_end + self._frame_size
+            if end > len(self._map):
+                self._remap(end + GROW_FRAMES * self._frame_size)
+            self._map[self._data_end:end] = buffer
+            self._last_offset = self._data_end
+            self._data_end = end
+            self._stored += 1
+            stored = self._frame_size
+            if self._shadow == None:
+                self._shadow = bytearray(self._frame_size)
+            self._shadow[:] = buffer
+        struct.pack_into(ENTRY, self._map, HEADER_SIZE + self._count * ENTRY_SIZE, time.time_ns(), self._last_offset)
+        self._count += 1
+        self._write_header()
+        return stored
+
+    def _write_header(self):
+        struct.pack_into(HEADER, self._map, 0, MAGIC, VERSION, HEADER_SIZE, self._width, self._height,
+                         self._frame_size, self._capacity, self._count, self._stored, self._data_end)
+
+    def _remap(self, size):
+        if self._map != None:
+            self._map.close()
+        self._file.truncate(size)
+        self._map = mmap.mmap(self._file.fileno(), size)
+
+class Recording():
+    """ Read access to a capture file written by Recorder, possibly still being recorded """
+
+    def __init__(self, filename) -> None:
+        self._file = open(filename, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, header_size, self.width, self.height, self._frame_size, self._capacity, _, _, _ = \
+            struct.unpack_from(HEADER, self._map, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('not a capture file')
+        self._index = header_size
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+    def __len__(self):
+        return struct.unpack_from(HEADER, self._map, 0)[7]
+
+    def stored(self):
+        """ Number of frames actually stored, the others are repeats """
+        return struct.unpack_from(HEADER, self._map, 0)[8]
+
+    def timestamp(self, index):
+        """ time.time_ns() of the frame """
+        return struct.unpack_from(ENTRY, self._map, self._entry(index))[0]
+
+    def frame(self, index):
+        """ Returns the frame as a memoryview into the capture """
+        offset = struct.unpack_from(ENTRY, self._map, self._entry(index))[1]
+        self._mapped(offset + self._frame_size)
+        return memoryview(self._map)[offset:offset + self._frame_size]
+
+    def find(self, timestamp):
+        """ Index of the frame displayed at timestamp (ns), i.e. the last one not after it """
+        low = 0
+        high = len(self)
+        while low < high:
+            middle = (low + high) // 2
+            if self.timestamp(middle) <= timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        return max(low - 1, 0)
+
+    def export_bmp(self, index, filename):
+        bmp = Bmp(filename, self.width, self.height)
+        bmp._write_file(self.frame(index))
+
+    def export_pbm(self, index, filename):
+        """ Binary PBM, lit pixels are white as in the BMP export """
+        frame = self.frame(index)
+        row_bytes = (self.width + 7) // 8
+        data = bytearray(row_bytes * self.height)
+        for y in range(self.height):
+            src = (y // 8) * self.width
+            bit = y % 8
+            for x in range(self.width):
+                if not (frame[src + x] >> bit) & 0x01:
+                    data[y * row_bytes + (x >> 3)] |= 0x80 >> (x & 0x07)
+        f = open(filename, 'wb')
+        f.write('P4\n{} {}\n'.format(self.width, self.height).encode())
+        f.write(data)
+        f.close()
+
+    def export(self, start, end, pattern, format='bmp'):
+        """ Exports the frames start to end (excluded), pattern is formatted with the index,
+        e.g. 'frame-{:06d}.bmp' """
+        export = self.export_bmp if format == 'bmp' else self.export_pbm
+        for index in range(start, end):
+            export(index, pattern.format(index))
+
+    def _entry(self, index):
+        if index < 0 or index >= len(self):
+            raise IndexError('frame {} not in the capture'.format(index))
+        offset = self._index + index * ENTRY_SIZE
+        self._mapped(offset + ENTRY_SIZE)
+        return offset
+
+    def _mapped(self, end):
+        # The file grows while it is recorded, map it again when the map is too short. The
+        # previous map is not closed, the frames returned so far are views into it
+        if end > len(self._map):
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            if end > len(self._map):
+                raise ValueError('capture file truncated')
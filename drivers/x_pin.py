@@ -1,12 +1,29 @@
 from machine import Pin
 import mcp23Sxx
 
-class XPin():
-    def __init__(self, ioext, no, dir=Pin.IN, pull=Pin.PULL_UP):
+class XPort():
+    """ Several expander pins read and written as one integer, bit i being pins[i] """
+
+    def __init__(self, ioext, pins, dir=Pin.IN, pull=Pin.PULL_UP):
         self._ioext = ioext
-        self._no = no
-        self._irq_handler = None
-        self._irq_trigger = None
+        self._pins = tuple(pins)
+        [self._ioext._validate_pin(pin) for pin in self._pins]
+
+        # Runs of consecutive pins as (port shift, run mask, value shift), so that
+        # moving bits between the port and the value takes one shift per run.
+        self._runs = []
+        self._mask = 0
+        start = 0
+        while start < len(self._pins):
+            end = start
+            while end + 1 < len(self._pins) and self._pins[end + 1] == self._pins[end] + 1:
+                end += 1
+            run_mask = (1 << (end - start + 1)) - 1
+            self._runs.append((self._pins[start], run_mask, start))
+            self._mask |= run_mask << self._pins[start]
+            start = end + 1
+        # Force a bus read on every value() call
+        self._read = True
         self.init(dir, pull)
 
     def __call__(self, v=None):
@@ -20,18 +37,33 @@ class XPin():
         if dir == Pin.IN and pull == Pin.PULL_UP:
             flags |= mcp23Sxx.INPUT_PULLUP
 
-        self._ioext.setup(self._no, dir, flags)
+        self._ioext.setup_pins({pin: (dir, flags) for pin in self._pins})
 
     def value(self, v=None):
-        if v != None and dir == Pin.OUT:
-            return self._ioext.output(self._no, v)
-        else:
-            # Do not force a read. The internal values must be updated some other way
-            return self._ioext.input_pins([self._no], False)[0]
+        if v != None and self._dir == Pin.OUT:
+            data = self._ioext.read_gpio(False) & ~self._mask
+            for shift, mask, value_shift in self._runs:
+                data |= ((v >> value_shift) & mask) << shift
+            self._ioext.write_gpio(data)
+            return None
+        data = self._ioext.read_gpio(self._read)
+        v = 0
+        for shift, mask, value_shift in self._runs:
+            v |= ((data >> shift) & mask) << value_shift
+        return v
 
     def deinit(self):
         pass
 
+class XPin(XPort):
+    def __init__(self, ioext, no, dir=Pin.IN, pull=Pin.PULL_UP):
+        self._no = no
+        self._irq_handler = None
+        self._irq_trigger = None
+        super().__init__(ioext, [no], dir, pull)
+        # Do not force a read. The internal values must be updated some other way
+        self._read = False
+
     def low(self):
         self.value(0)
 
@@ -47,7 +79,10 @@ class XPin():
     def irq(self, handler, trigger=Pin.IRQ_FALLING|Pin.IRQ_RISING, *, priority=1, wake=None, hard=False):
         self._irq_handler = handler
         self._irq_trigger = trigger
-        self._ioext.registerInterruptHandler(self._no, self._internal_irq)
+        if handler == None:
+            self._ioext.unregisterInterruptHandler(self._no)
+        else:
+            self._ioext.registerInterruptHandler(self._no, self._internal_irq)
 
     def _internal_irq(self, new_val):
         if self._irq_handler != None:
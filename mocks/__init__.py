@@ -1,6 +1,7 @@
 from .pin import *
 from .spi import *
 from .mem32 import *
+from .timer import *
 
 def unique_id():
     return b"upy-non-unique"
@@ -0,0 +1,320 @@
+# Model of a KS0108 panel (one controller per 64 columns) rebuilding the display RAM
+# from the bus traffic of the drivers: mock Pin traces, MCP23S17 SPI transfers or the
+# PIO FIFO words.
+
+CMD_DISPLAY_OFF = 0x3e
+CMD_DISPLAY_ON = 0x3f
+
+# Controller enable cycle time (tcyc) from the datasheet
+CYCLE_NS = 1000
+
+class Ks0108Controller():
+    """ One controller: 8 pages of 64 columns, page and column (Y) address registers,
+    the column address increments after each data write """
+
+    def __init__(self):
+        self.ram = bytearray(512)
+        self.on = False
+        self.start_line = 0
+        self.page = 0
+        self.column = 0
+
+    def command(self, cmd):
+        if cmd & 0xfe == CMD_DISPLAY_OFF:
+            self.on = cmd == CMD_DISPLAY_ON
+        elif cmd & 0xc0 == 0x40:
+            self.column = cmd & 0x3f
+        elif cmd & 0xf8 == 0xb8:
+            self.page = cmd & 0x07
+        elif cmd & 0xc0 == 0xc0:
+            self.start_line = cmd & 0x3f
+        else:
+            raise ValueError('unknown KS0108 command 0x{:02x}'.format(cmd))
+
+    def data(self, value):
+        self.ram[self.page * 64 + self.column] = value
+        self.column = (self.column + 1) & 0x3f
+
+class Ks0108Emulator():
+    """ The controllers of a width x height panel and the bus cycles they received """
+
+    def __init__(self, width=128, height=64, cycle_ns=CYCLE_NS):
+        self.width = width
+        self.height = height
+        self.cycle_ns = cycle_ns
+        self.controllers = [Ks0108Controller() for i in range(width // 64)]
+        self.reset_counters()
+
+    def reset_counters(self):
+        self.commands = 0
+        self.data_writes = 0
+
+    def write(self, rs, chips, value):
+        """ One write cycle: rs 0 for a command, 1 for data, to the controllers whose bit is
+        set in chips (cs lines active high as wired for the drivers) """
+        if rs:
+            self.data_writes += 1
+        else:
+            self.commands += 1
+        for chip in range(len(self.controllers)):
+            if (chips >> chip) & 0x01:
+                if rs:
+                    self.controllers[chip].data(value)
+                else:
+                    self.controllers[chip].command(value)
+
+    def bus_time_us(self):
+        """ Minimum bus time of the cycles counted since reset_counters() """
+        return (self.commands + self.data_writes) * self.cycle_ns / 1000
+
+    def framebuffer(self):
+        """ Display RAM in the drivers' buffer layout (page * width + column) """
+        buffer = bytearray(self.width * (self.height // 8))
+        for chip, controller in enumerate(self.controllers):
+            for page in range(self.height // 8):
+                offset = page * self.width + chip * 64
+                buffer[offset:offset + 64] = controller.ram[page * 64:page * 64 + 64]
+        return buffer
+
+    def screen(self):
+        """ What is visible, in the buffer layout: each controller shows its RAM from its
+        start line, blank when off """
+        buffer = bytearray(self.width * (self.height // 8))
+        for chip, controller in enumerate(self.controllers):
+            if not controller.on:
+                continue
+            for y in range(self.height):
+                line = (y + controller.start_line) & 0x3f
+                src = (line // 8) * 64
+                dst = (y // 8) * self.width + chip * 64
+                for x in range(64):
+                    if (controller.ram[src + x] >> (line % 8)) & 0x01:
+                        buffer[dst + x] |= 1 << (y % 8)
+        return buffer
+
+class PinDecoder():
+    """ Decodes (timestamp, pin, value) transitions, e.g. mocks.Pin.tracer.transitions(),
+    given the pin numbers. Data is latched on the e falling edge with rw low. The levels are
+    tracked across feed() calls, which must see every transition since the pins were created. """
+
+    def __init__(self, emulator, e, cs, rs, rw, data):
+        self._emulator = emulator
+        self._e = e
+        self._cs = cs
+        self._rs = rs
+        self._rw = rw
+        self._data = data
+        self._levels = {}
+
+    def feed(self, transitions):
+        levels = self._levels
+        for ticks, pin, value in transitions:
+            if pin == self._e and value == 0 and levels.get(pin, 0) == 1 and not levels.get(self._rw, 0):
+                self._latch()
+            levels[pin] = value
+
+    def _latch(self):
+        levels = self._levels
+        chips = 0
+        for chip in range(len(self._cs)):
+            chips |= levels.get(self._cs[chip], 0) << chip
+        value = 0
+        for bit in range(8):
+            value |= levels.get(self._data[bit], 0) << bit
+        self._emulator.write(levels.get(self._rs, 0), chips, value)
+
+class _EPin():
+    """ Pin given to a driver as its e line, latching the expander outputs on the falling edge """
+
+    def __init__(self, decoder):
+        self._decoder = decoder
+        self._value = 0
+
+    def init(self, *args, **kwargs):
+        pass
+
+    def value(self, v=None):
+        if v == None:
+            return self._value
+        if self._value and not v:
+            self._decoder._latch(self._decoder._word)
+        self._value = 1 if v else 0
+
+    def __call__(self, v=None):
+        return self.value(v)
+
+    def high(self):
+        self.value(1)
+
+    def low(self):
+        self.value(0)
+
+class ExpanderDecoder():
+    """ Decodes the 16 bits expander outputs, given the bit masks of the lines as used by
+    SpiKs0108. When e is wired to the expander, data is latched when its bit falls. Otherwise
+    e_pin is to be given to the driver as its e line. """
+
+    def __init__(self, emulator, e, cs, rs, rw, data):
+        """ e : expander bit of the e line, or None when it is an MCU pin """
+        self._emulator = emulator
+        self._e = e
+        self._cs = cs
+        self._rs = rs
+        self._rw = rw
+        self._data = data
+        self._word = 0
+        self.e_pin = _EPin(self) if e == None else None
+
+    def output(self, word):
+        """ New state of the expander outputs """
+        if self._e != None and (self._word & self._e) and not (word & self._e):
+            # The other lines are stable across the falling edge
+            self._latch(word)
+        self._word = word
+
+    def _latch(self, word):
+        if word & self._rw:
+            return
+        chips = 0
+        for chip in range(len(self._cs)):
+            if word & self._cs[chip]:
+                chips |= 1 << chip
+        value = 0
+        for bit in range(8):
+            if word & self._data[bit]:
+                value |= 1 << bit
+        self._emulator.write(1 if word & self._rs else 0, chips, value)
+
+class _CsPin():
+    def __init__(self, device):
+        self._device = device
+        self._value = 1
+
+    def init(self, *args, **kwargs):
+        pass
+
+    def value(self, v=None):
+        if v == None:
+            return self._value
+        v = 1 if v else 0
+        if v != self._value:
+            self._device._select(not v)
+        self._value = v
+
+    def __call__(self, v=None):
+        return self.value(v)
+
+    def high(self):
+        self.value(1)
+
+    def low(self):
+        self.value(0)
+
+class Mcp23s17Device():
+    """ MCP23S17 (BANK 0) on the SPI side: give spi and cs to the driver, every change of
+    the output latches is passed as a 16 bits word to output(word), e.g.
+    ExpanderDecoder.output. The address pointer follows IOCON.SEQOP. """
+
+    def __init__(self, output, device_id=0):
+        self._output = output
+        self._opcode = 0x40 | (device_id << 1)
+        self.registers = bytearray(0x16)
+        # IODIR reset to inputs
+        self.registers[0x00] = 0xff
+        self.registers[0x01] = 0xff
+        self.spi = self
+        self.cs = _CsPin(self)
+        self._selected = False
+        self._position = 0
+        self._read = False
+        self._address = 0
+
+    def _select(self, selected):
+        self._selected = selected
+        self._position = 0
+
+    def write(self, data):
+        for byte in memoryview(data).cast('B'):
+            self._byte(byte)
+
+    def write_readinto(self, txdata, rxdata):
+        for i in range(len(txdata)):
+            rxdata[i] = self._byte(txdata[i])
+
+    def _byte(self, byte):
+        position = self._position
+        self._position += 1
+        if position == 0:
+            self._read = byte & 0x01
+            # Other devices on the bus ignore the rest of the transaction
+            self._address = None if byte & 0xfe != self._opcode else 0
+            return 0
+        if self._address == None:
+            return 0
+        if position == 1:
+            self._address = byte % len(self.registers)
+            return 0
+        address = self._address
+        value = self.registers[address]
+        if not self._read:
+            self._write_register(address, byte)
+        if self.registers[0x0a] & 0x20:
+            # SEQOP set: the pointer toggles within the A/B pair
+            self._address = address ^ 0x01
+        else:
+            self._address = (address + 1) % len(self.registers)
+        return value
+
+    def _write_register(self, address, byte):
+        # GPIO writes go to the output latches
+        if address in (0x12, 0x13):
+            address += 2
+        if address in (0x0a, 0x0b):
+            self.registers[0x0a] = byte
+            self.registers[0x0b] = byte
+            return
+        previous = self.registers[address]
+        self.registers[address] = byte
+        if address in (0x14, 0x15) and byte != previous:
+            self._output(self.registers[0x14] | (self.registers[0x15] << 8))
+
+class PioDecoder():
+    """ Decodes the (state machine, word) FIFO pushes of PioKs0108, e.g. mocks.rp2.fifo_log.
+    The ctrl words are rw, rs, cs0, cs1 from bit 0. In DMA mode the data stream is made of
+    segments: a count minus one then the bytes, each segment taking the next ctrl word. """
+
+    def __init__(self, emulator, dma=False, data_sm=1, ctrl_sm=2):
+        self._emulator = emulator
+        self._dma = dma
+        self._data_sm = data_sm
+        self._ctrl_sm = ctrl_sm
+        self._ctrl = 0
+        self._ctrl_words = []
+        self._remaining = 0
+        self._segment = False
+
+    def feed(self, fifo_log):
+        for sm, word in fifo_log:
+            if sm == self._ctrl_sm:
+                if self._dma:
+                    self._ctrl_words.append(word & 0x0f)
+                else:
+                    self._ctrl = word & 0x0f
+            elif sm == self._data_sm:
+                self._data(word & 0xff)
+
+    def _data(self, value):
+        if self._dma:
+            if not self._remaining:
+                # Segment header, the ctrl state machine then applies its next word
+                self._remaining = value + 1
+                self._segment = True
+                return
+            if self._segment:
+                self._ctrl = self._ctrl_words.pop(0)
+                self._segment = False
+            self._remaining -= 1
+        ctrl = self._ctrl
+        if ctrl & 0x01:
+            return
+        self._emulator.write((ctrl >> 1) & 0x01, ctrl >> 2, value)
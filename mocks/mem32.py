@@ -1,7 +1,34 @@
+SIO_GPIO_OUT = 0xd0000010
+SIO_GPIO_OUT_SET = 0xd0000014
+SIO_GPIO_OUT_CLR = 0xd0000018
+SIO_GPIO_OUT_XOR = 0xd000001c
+
+class Mem32():
+    """ Records every write as (address, value) and applies the SIO GPIO
+    set/clear/xor aliases to GPIO_OUT, so that pin waveforms can be checked.
+    With record False the writes are only counted, nothing is allocated per write """
 
-class mem32():
     def __init__(self):
-        pass
+        self.writes = []
+        self.count = 0
+        self.record = True
+        self._values = {}
 
     def __getitem__(self, addr):
-        return 0x00000000
+        return self._values.get(addr, 0x00000000)
+
+    def __setitem__(self, addr, value):
+        self.count += 1
+        if self.record:
+            self.writes.append((addr, value))
+        out = self._values.get(SIO_GPIO_OUT, 0)
+        if addr == SIO_GPIO_OUT_SET:
+            self._values[SIO_GPIO_OUT] = out | value
+        elif addr == SIO_GPIO_OUT_CLR:
+            self._values[SIO_GPIO_OUT] = out & ~value
+        elif addr == SIO_GPIO_OUT_XOR:
+            self._values[SIO_GPIO_OUT] = out ^ value
+        else:
+            self._values[addr] = value
+
+mem32 = Mem32()
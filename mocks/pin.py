@@ -1,3 +1,8 @@
+import os
+import mmap
+import time
+from array import array
+
 IN = "in"
 OUT = "out"
 PULL_DOWN = "pull_down"
@@ -8,12 +13,103 @@ IRQ_RISING = 0x02
 IRQ_LOW_LEVEL = 0x04
 IRQ_HIGH_LEVEL = 0x08
 
+class MemoryBackend():
+    """ Pin values kept in a dict, the default backend """
+
+    def __init__(self):
+        self._values = {}
+
+    def read(self, no):
+        return self._values.get(no, 0)
+
+    def write(self, no, v):
+        self._values[no] = v
+
+class MmapBackend():
+    """ Pin values in a memory-mapped file, one byte (0 or 1) per pin number, so that
+    another process can observe or drive the pins without a syscall per access """
+
+    def __init__(self, filename, size=64):
+        self._file = open(filename, 'a+b')
+        if os.path.getsize(filename) < size:
+            self._file.truncate(size)
+        self._map = mmap.mmap(self._file.fileno(), size)
+
+    def read(self, no):
+        return self._map[no]
+
+    def write(self, no, v):
+        self._map[no] = v
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+class FileBackend():
+    """ One text file per pin, named pin<no>, in path (Pin.path when None) """
+
+    def __init__(self, path=None):
+        self._path = path
+
+    def read(self, no):
+        filename = self._get_filename(no)
+        if not os.path.exists(filename):
+            return 0
+        f = open(filename, 'r')
+        buf = f.read(1)
+        f.close()
+        return int(buf[0])
+
+    def write(self, no, v):
+        f = open(self._get_filename(no), 'w')
+        f.write(str(v))
+        f.close()
+
+    def _get_filename(self, no):
+        return '{}/pin{}'.format(Pin.path if self._path == None else self._path, no)
+
+class Tracer():
+    """ Records the pin transitions as (timestamp ns, pin, value) in compact arrays """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self._ticks = array('q')
+        self._pins = array('H')
+        self._values = array('B')
+
+    def _record(self, no, v):
+        self._ticks.append(time.perf_counter_ns())
+        self._pins.append(no)
+        self._values.append(v)
+
+    def __len__(self):
+        return len(self._ticks)
+
+    def transitions(self):
+        """ Yields every (timestamp ns, pin, value), oldest first """
+        for i in range(len(self._ticks)):
+            yield (self._ticks[i], self._pins[i], self._values[i])
+
+    def waveform(self, no):
+        """ Returns the successive values of a pin """
+        return [self._values[i] for i in range(len(self._pins)) if self._pins[i] == no]
+
 class Pin():
     IN = IN
     OUT = OUT
     PULL_DOWN = PULL_DOWN
     PULL_UP = PULL_UP
+    IRQ_FALLING = IRQ_FALLING
+    IRQ_RISING = IRQ_RISING
+    IRQ_LOW_LEVEL = IRQ_LOW_LEVEL
+    IRQ_HIGH_LEVEL = IRQ_HIGH_LEVEL
     path = '.'
+    # Where the pin values are stored, shared by every pin
+    backend = MemoryBackend()
+    # Tracer recording the transitions, None when disabled
+    tracer = None
 
     def __init__(self, no, dir=IN, pull=PULL_UP):
         self._no = no
@@ -31,19 +127,13 @@ class Pin():
 
     def value(self, v=None):
         if v == None:
-            f = open(self._get_filename(), 'r')
-            buf = f.read(1)
-            f.close()
-            return int(buf[0])
-        else :
-            f = open(self._get_filename(), 'w')
-            f.write(str(v))
-            f.close()
+            return Pin.backend.read(self._no)
+        v = 1 if v else 0
+        if Pin.tracer != None and Pin.backend.read(self._no) != v:
+            Pin.tracer._record(self._no, v)
+        Pin.backend.write(self._no, v)
         return 0
 
-    def _get_filename(self):
-        return '{}/pin{}'.format(Pin.path, self._no)
-
     def deinit(self):
         pass
 
@@ -0,0 +1,130 @@
+# Stand-in for the rp2 module: state machines and DMA channels record the words
+# pushed to the TX FIFOs instead of driving pins.
+
+class PIO():
+    IN_LOW = 0
+    IN_HIGH = 1
+    OUT_LOW = 2
+    OUT_HIGH = 3
+    SHIFT_LEFT = 0
+    SHIFT_RIGHT = 1
+    JOIN_NONE = 0
+    JOIN_TX = 1
+    JOIN_RX = 2
+
+    def __init__(self, id):
+        self._id = id
+
+    def state_machine(self, id, *args, **kwargs):
+        return StateMachine(self._id * 4 + id, *args, **kwargs)
+
+def asm_pio(**kwargs):
+    # The program body uses the PIO assembler names and is never executed here
+    def decorator(program):
+        program.asm_pio_kwargs = kwargs
+        return program
+    return decorator
+
+# Every word pushed to a TX FIFO as (state machine id, word), in push order
+fifo_log = []
+
+_PIO_BASE = (0x50200000, 0x50300000)
+_PIO_TXF0 = 0x010
+
+def tx_fifo_address(sm_id):
+    return _PIO_BASE[sm_id // 4] + _PIO_TXF0 + 4 * (sm_id % 4)
+
+_state_machines = {}
+
+class StateMachine():
+    def __init__(self, id, program=None, freq=-1, **kwargs):
+        self._id = id
+        self.words = []
+        self._active = 0
+        _state_machines[id] = self
+        self.init(program, freq, **kwargs)
+
+    def init(self, program=None, freq=-1, **kwargs):
+        self._program = program
+        self._freq = freq
+        self._kwargs = kwargs
+
+    def active(self, value=None):
+        if value == None:
+            return self._active
+        self._active = value
+
+    def put(self, value, shift=0):
+        if isinstance(value, int):
+            self._push(value >> shift)
+        else:
+            for word in value:
+                self._push(word >> shift)
+
+    def _push(self, word):
+        word &= 0xFFFFFFFF
+        self.words.append(word)
+        fifo_log.append((self._id, word))
+
+    def tx_fifo(self):
+        return 0
+
+    def irq(self, handler=None, trigger=0, hard=False):
+        pass
+
+class DMA():
+    """ Transfers run to completion as soon as the channel is triggered """
+
+    def __init__(self):
+        self.read = None
+        self.write = None
+        self.count = 0
+        self.ctrl = 0
+        self._handler = None
+
+    def pack_ctrl(self, default=None, **kwargs):
+        ctrl = dict(default) if default else {'size': 2, 'inc_read': True, 'inc_write': True}
+        ctrl.update(kwargs)
+        return ctrl
+
+    def unpack_ctrl(self, ctrl):
+        return dict(ctrl)
+
+    def config(self, read=None, write=None, count=None, ctrl=None, trigger=False):
+        if read != None:
+            self.read = read
+        if write != None:
+            self.write = write
+        if count != None:
+            self.count = count
+        if ctrl != None:
+            self.ctrl = ctrl
+        if trigger:
+            self.active(1)
+
+    def active(self, value=None):
+        if value == None:
+            return 0
+        if value:
+            self._transfer()
+
+    def _transfer(self):
+        target = self.write
+        if isinstance(target, int):
+            target = [sm for sm in _state_machines.values() if tx_fifo_address(sm._id) == target][0]
+        size = 1 << self.ctrl.get('size', 2)
+        data = memoryview(self.read).cast('B')
+        for i in range(self.count):
+            word = int.from_bytes(data[i * size:(i + 1) * size], 'little')
+            if size == 1:
+                # Byte writes to a FIFO are replicated on the 4 byte lanes
+                word *= 0x01010101
+            target._push(word)
+        if self._handler != None:
+            self._handler(self)
+
+    def irq(self, handler=None, hard=False):
+        self._handler = handler
+
+    def close(self):
+        pass
@@ -0,0 +1,13 @@
+class Timer():
+    ONE_SHOT = 0
+    PERIODIC = 1
+
+    def __init__(self, id=-1, mode=PERIODIC, freq=-1, period=-1, callback=None):
+        self.init(mode=mode, freq=freq, period=period, callback=callback)
+
+    def init(self, mode=PERIODIC, freq=-1, period=-1, callback=None):
+        self._mode = mode
+        self._callback = callback
+
+    def deinit(self):
+        self._callback = None